@@ -0,0 +1,61 @@
+"""
+Password verification throughput, i.e. the CPU cost of a login.
+
+Reports logins per second for one thread and for the async views' hashing
+pool, normalised per core, for each configured hasher:
+
+    python benchmarks/bench_password_hashing.py --seconds 5 --workers 4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "social_network.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.hashers import check_password, get_hashers  # noqa: E402
+
+PASSWORD = 'correct horse battery staple'
+
+
+def verifications_per_second(encoded, seconds, workers):
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        done = 0
+        while time.perf_counter() < deadline:
+            check_password(PASSWORD, encoded)
+            done += 1
+        return done
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        total = sum(pool.map(lambda _: worker(), range(workers)))
+    return total / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--workers', type=int, default=settings.PASSWORD_HASHING_WORKERS)
+    args = parser.parse_args()
+
+    print(f"{'hasher':<32} {'1 thread/s':>12} {f'{args.workers} threads/s':>14} {'per core/s':>12}")
+    for hasher in get_hashers():
+        encoded = hasher.encode(PASSWORD, hasher.salt())
+        single = verifications_per_second(encoded, args.seconds, 1)
+        pooled = verifications_per_second(encoded, args.seconds, args.workers)
+        per_core = pooled / min(args.workers, os.cpu_count() or 1)
+        print(f"{type(hasher).__name__:<32} {single:>12.1f} {pooled:>14.1f} {per_core:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Compare two ``benchmarks/run.py`` result files and flag regressions.
+
+    python benchmarks/compare.py benchmarks/results/<base>.json benchmarks/results/<head>.json --threshold 10
+
+Exits with status 1 when any endpoint's p95 latency grew, or its throughput
+fell, by more than the threshold percentage, or when it runs more queries.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as file:
+        run = json.load(file)
+    return run, {(row['endpoint'], row['mode'], row['profile']): row for row in run['results']}
+
+
+def change(base, head):
+    if not base or head is None:
+        return None
+    return (head - base) / base * 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=10, help='allowed slowdown, in percent')
+    args = parser.parse_args()
+
+    base_run, base = load(args.base)
+    head_run, head = load(args.head)
+    print(f"base {(base_run.get('commit') or '?')[:12]}  head {(head_run.get('commit') or '?')[:12]}")
+    print(f"{'endpoint':<14} {'mode':<6} {'profile':<7} {'p50 %':>8} {'p95 %':>8} {'p99 %':>8} {'req/s %':>8} "
+          f"{'queries':>9}")
+
+    regressions = []
+    for key in sorted(base.keys() & head.keys()):
+        before, after = base[key], head[key]
+        deltas = {name: change(before[name], after[name]) for name in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput')}
+        queries = f"{before.get('queries_avg')}->{after.get('queries_avg')}"
+        more_queries = (after.get('queries_avg') or 0) > (before.get('queries_avg') or 0)
+        regressed = more_queries or (deltas['p95_ms'] or 0) > args.threshold or \
+            -(deltas['throughput'] or 0) > args.threshold
+        if regressed:
+            regressions.append(key)
+        print(f"{key[0]:<14} {key[1]:<6} {key[2]:<7} " + ' '.join(
+            f"{delta:>+8.1f}" if delta is not None else f"{'-':>8}" for delta in deltas.values()
+        ) + f" {queries:>9}" + ('  REGRESSION' if regressed else ''))
+
+    for key in sorted(base.keys() ^ head.keys()):
+        print(f"{key[0]:<14} {key[1]:<6} {key[2]:<7} only in {'base' if key in base else 'head'}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""HTTP helpers shared by the benchmark scripts; standard library only."""
+import json
+import math
+import re
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def request(method, url, token=None, body=None, timeout=30):
+    """Return ``(status, seconds, headers, payload)`` for one request."""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method)
+    req.add_header('Content-Type', 'application/json')
+    if token:
+        req.add_header('Authorization', f'Bearer {token}')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            payload = response.read()
+            return response.status, time.perf_counter() - started, response.headers, payload
+    except urllib.error.HTTPError as exc:
+        return exc.code, time.perf_counter() - started, exc.headers, exc.read()
+
+
+def open_stream(url, token=None, timeout=30):
+    """
+    Open a streamed response and read its first line, like :func:`request`;
+    ``seconds`` is the time until that line arrived. The stream is then closed.
+    """
+    req = urllib.request.Request(url)
+    if token:
+        req.add_header('Authorization', f'Bearer {token}')
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            payload = response.readline()
+            return response.status, time.perf_counter() - started, response.headers, payload
+    except urllib.error.HTTPError as exc:
+        return exc.code, time.perf_counter() - started, exc.headers, exc.read()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def query_count(headers):
+    """Queries the server reported in its ``Server-Timing`` header, if any."""
+    match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing', '') if headers else '')
+    return int(match.group(1)) if match else None
+
+
+def run_load(send, total, concurrency):
+    """
+    Call ``send(i)`` ``total`` times from ``concurrency`` threads. ``send``
+    returns the result of :func:`request`.
+    """
+    results = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [seconds for _, seconds, _, _ in results]
+    errors = sum(1 for status, _, _, _ in results if status >= 400)
+    queries = [count for count in (query_count(headers) for _, _, headers, _ in results) if count is not None]
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries_avg': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+def login(base_url, email, password, name='benchmark'):
+    """Sign the user up if needed and return an access token."""
+    request('POST', f'{base_url}/api/signup/', body={'email': email, 'password': password, 'name': name})
+    status, _, _, payload = request('POST', f'{base_url}/api/login/', body={'email': email, 'password': password})
+    if status != 200:
+        raise SystemExit(f'Login as {email} failed with {status}: {payload[:200]!r}')
+    return json.loads(payload)['results']['data']['tokens']['access']
@@ -0,0 +1,53 @@
+"""
+Concurrent-request throughput of the sync views behind a WSGI server
+against their async counterparts behind the ASGI server.
+
+Start both servers against the same database, then run the comparison:
+
+    gunicorn social_network.wsgi:application -w 4 -b 127.0.0.1:8001
+    gunicorn social_network.asgi:application -k uvicorn.workers.UvicornWorker -w 4 -b 127.0.0.1:8002
+    python benchmarks/load_test.py --wsgi-url http://127.0.0.1:8001 --asgi-url http://127.0.0.1:8002
+"""
+import argparse
+import json
+import sys
+import uuid
+
+from driver import login, request, run_load
+
+# (name, sync path, async path)
+ENDPOINTS = [
+    ('search', '/api/search/?q=benchmark', '/api/async/search/?q=benchmark'),
+    ('friends', '/api/friends/', '/api/async/friends/'),
+    ('pending', '/api/friend-requests/pending/', '/api/async/friend-requests/pending/'),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wsgi-url', default='http://127.0.0.1:8001')
+    parser.add_argument('--asgi-url', default='http://127.0.0.1:8002')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    token = login(args.wsgi_url, f'load-{uuid.uuid4().hex[:12]}@example.com', 'load-test-password')
+
+    results = []
+    print(f"{'endpoint':<10} {'server':<6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, sync_path, async_path in ENDPOINTS:
+        for server, url in (('wsgi', args.wsgi_url + sync_path), ('asgi', args.asgi_url + async_path)):
+            stats = run_load(lambda _: request('GET', url, token), args.requests, args.concurrency)
+            results.append({'endpoint': name, 'server': server, **stats})
+            print(f"{name:<10} {server:<6} {stats['throughput']:>9} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+                  f"{stats['p99_ms']:>9} {stats['errors']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
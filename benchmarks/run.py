@@ -0,0 +1,236 @@
+"""
+Drive every endpoint of the API against a seeded database and record
+latency percentiles, throughput and query counts per endpoint.
+
+Seed a graph, start the server with the friend request throttle lifted (and
+``REDIS_URL`` set when running several workers, so they share invalidations),
+then run:
+
+    python manage.py seed_graph --users 10000 --clear
+    python manage.py compute_friend_suggestions
+    export METRICS_TOKEN=$(openssl rand -hex 16)
+    FRIEND_REQUEST_THROTTLE_RATE=100000/minute \\
+        gunicorn social_network.asgi:application -k uvicorn.workers.UvicornWorker -w 4 -b 127.0.0.1:8000
+    python benchmarks/run.py --users 10000
+
+Read endpoints are measured as the seeded hub, median and leaf users, so the
+friends and pending lists are exercised at very different sizes. Write
+endpoints, token refresh and logout run on users the script signs up itself.
+The event stream is measured to its first line, since it stays open until the
+token expires. Cache statistics are staff only, so they are measured when
+``--staff-email`` names a staff user (``python manage.py createsuperuser``).
+Query counts come from the ``Server-Timing`` header. Compare two runs with
+``benchmarks/compare.py``.
+"""
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from driver import open_stream, request, run_load
+
+# (endpoint, sync path, async path)
+READ_ENDPOINTS = [
+    ('friends', '/api/friends/', '/api/async/friends/'),
+    ('pending', '/api/friend-requests/pending/', '/api/async/friend-requests/pending/'),
+    ('summary', '/api/me/summary/', '/api/async/me/summary/'),
+]
+
+
+def commit_sha():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def data(payload):
+    return json.loads(payload)['results']['data']
+
+
+def token_user_id(token):
+    claims = token.split('.')[1]
+    return json.loads(base64.urlsafe_b64decode(claims + '=' * (-len(claims) % 4)))['user_id']
+
+
+def access_token(base_url, email, password, hint='seed the database with seed_graph first'):
+    status, _, _, payload = request('POST', f'{base_url}/api/login/', body={'email': email, 'password': password})
+    if status != 200:
+        raise SystemExit(f'Login as {email} failed with {status}; {hint}.')
+    return data(payload)['tokens']['access']
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.base_url.rstrip('/')
+        self.results = []
+
+    def measure(self, endpoint, mode, profile, send, total):
+        stats = run_load(send, total, self.args.concurrency)
+        self.results.append({'endpoint': endpoint, 'mode': mode, 'profile': profile, **stats})
+        queries = '-' if stats['queries_avg'] is None else stats['queries_avg']
+        print(f"{endpoint:<14} {mode:<6} {profile:<7} {stats['throughput']:>9} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} {queries:>8} {stats['errors']:>7}")
+
+    def get(self, endpoint, mode, profile, path, token):
+        url = self.base_url + path
+        self.measure(endpoint, mode, profile, lambda _: request('GET', url, token), self.args.requests)
+
+    def reads(self):
+        users = self.args.users
+        profiles = {'hub': 0, 'median': users // 2, 'leaf': users - 1}
+        tokens = {
+            profile: access_token(self.base_url, f'seed-{index}@example.com', self.args.password)
+            for profile, index in profiles.items()
+        }
+        for endpoint, sync_path, async_path in READ_ENDPOINTS:
+            for profile, token in tokens.items():
+                self.get(endpoint, 'sync', profile, sync_path, token)
+                self.get(endpoint, 'async', profile, async_path, token)
+
+        # Mutual friends with the hub, whose friend list is the longest to intersect.
+        hub_id = token_user_id(tokens['hub'])
+        for profile in ('median', 'leaf'):
+            self.get('mutual', 'sync', profile, f'/api/friends/mutual/{hub_id}/', tokens[profile])
+        for profile, token in tokens.items():
+            self.get('suggestions', 'sync', profile, '/api/friends/suggestions/', token)
+
+        search = f'?q={self.args.search}'
+        self.get('search', 'sync', 'median', '/api/search/' + search, tokens['median'])
+        self.get('search', 'async', 'median', '/api/async/search/' + search, tokens['median'])
+        self.get('search-cursor', 'sync', 'median', f'/api/search/{search}&pagination=cursor', tokens['median'])
+        self.get('metrics', 'sync', '-', '/api/metrics/', os.environ.get('METRICS_TOKEN'))
+        if self.args.staff_email:
+            staff = access_token(self.base_url, self.args.staff_email, self.args.staff_password or self.args.password,
+                                 'pass the password of the --staff-email user as --staff-password')
+            self.get('cache-stats', 'sync', '-', '/api/cache/stats/', staff)
+
+        # Until the stream's first line: subscribing to the user's events, not waiting for any.
+        url = f'{self.base_url}/api/async/events/'
+        self.measure('events', 'async', 'median', lambda _: open_stream(url, tokens['median']), self.args.requests)
+
+    def writes(self, mode):
+        """
+        Sign up ``n`` users, then have user ``i`` befriend user ``i + 1`` and
+        bulk-befriend the next few, refreshing their tokens before and logging
+        out after.
+        """
+        n = self.args.write_requests
+        prefix = '/api/async' if mode == 'async' else '/api'
+        run = uuid.uuid4().hex[:8]
+        emails = [f'bench-{run}-{i}@example.com' for i in range(n)]
+        tokens = [None] * n
+        refresh_tokens = [None] * n
+        request_ids = [None] * n
+
+        def post(path, body, token=None, method='POST'):
+            return request(method, f'{self.base_url}{prefix}{path}', token, body)
+
+        def signup(i):
+            result = post('/signup/', {'email': emails[i], 'password': self.args.password, 'name': f'Bench {i}'})
+            if result[0] == 201:
+                tokens[i] = data(result[3])['tokens']['access']
+            return result
+
+        def login(i):
+            result = post('/login/', {'email': emails[i], 'password': self.args.password})
+            if result[0] == 200:
+                refresh_tokens[i] = data(result[3])['tokens']['refresh']
+            return result
+
+        def refresh(i):
+            result = post('/token/refresh/', {'refresh': refresh_tokens[i]})
+            if result[0] == 200:
+                # Rotated: the old refresh token is revoked, keep the new one for logging out.
+                refresh_tokens[i] = data(result[3])['tokens']['refresh']
+            return result
+
+        def logout(i):
+            return post('/logout/', {'refresh': refresh_tokens[i]})
+
+        def send(i):
+            result = post('/friend-request/', {'receiver': user_ids[(i + 1) % n]}, tokens[i])
+            if result[0] in (200, 201):
+                request_ids[i] = data(result[3])['id']
+            return result
+
+        def respond(i):
+            return post(f'/friend-request/{request_ids[i]}/', {'action': 'accept'}, tokens[(i + 1) % n], 'PATCH')
+
+        self.measure('signup', mode, 'new', signup, n)
+        self.measure('login', mode, 'new', login, n)
+        if None in tokens:
+            raise SystemExit(f'{tokens.count(None)} {mode} signups failed; write endpoints cannot be measured.')
+        user_ids = [token_user_id(token) for token in tokens]
+        self.measure('refresh', mode, 'new', refresh, n)
+        self.measure('send', mode, 'new', send, n)
+        self.measure('respond', mode, 'new', respond, n)
+        if mode == 'async':
+            self.measure('logout', mode, 'new', logout, n)
+            return
+
+        # Stay short of half the ring so no bulk request meets one sent the other way.
+        fan_out = min(self.args.bulk_size, (n - 3) // 2)
+
+        def bulk_send(i):
+            receivers = [user_ids[(i + offset) % n] for offset in range(2, 2 + fan_out)]
+            return post('/friend-request/bulk/', {'receivers': receivers}, tokens[i])
+
+        def bulk_respond(i):
+            _, _, _, payload = request('GET', f'{self.base_url}/api/friend-requests/pending/', tokens[i])
+            actions = [{'id': row['id'], 'action': 'accept'} for row in data(payload)['results']]
+            return post('/friend-request/bulk/respond/', {'requests': actions}, tokens[i])
+
+        if fan_out > 0:
+            self.measure('bulk-send', mode, 'new', bulk_send, n)
+            # Includes fetching the pending list the user responds to.
+            self.measure('bulk-respond', mode, 'new', bulk_respond, n)
+        self.measure('logout', mode, 'new', logout, n)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=10_000, help='--users the database was seeded with')
+    parser.add_argument('--password', default='benchmark-password', help='--password the database was seeded with')
+    parser.add_argument('--search', default='Anna')
+    parser.add_argument('--requests', type=int, default=500, help='requests per read endpoint')
+    parser.add_argument('--write-requests', type=int, default=50, help='users signed up per write run')
+    parser.add_argument('--bulk-size', type=int, default=10)
+    parser.add_argument('--staff-email', help='staff user to measure the cache statistics as; skipped when not set')
+    parser.add_argument('--staff-password', help='defaults to --password')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--label', help='free-form note stored with the results')
+    parser.add_argument('--output', help='JSON file for the results; defaults to benchmarks/results/<commit>.json')
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args)
+    print(f"{'endpoint':<14} {'mode':<6} {'profile':<7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'queries':>8} {'errors':>7}")
+    benchmark.reads()
+    benchmark.writes('sync')
+    benchmark.writes('async')
+
+    sha = commit_sha()
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results', f'{(sha or "unknown")[:12]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({
+            'commit': sha,
+            'label': args.label,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'base_url': args.base_url,
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'label')},
+            'results': benchmark.results,
+        }, file, indent=2)
+    print(f'Wrote {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
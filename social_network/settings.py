@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import copy
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "users.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -48,6 +51,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "users.middleware.PrimaryPinMiddleware",
 ]
 
 ROOT_URLCONF = "social_network.urls"
@@ -73,22 +77,141 @@ WSGI_APPLICATION = "social_network.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# PostgreSQL in production (DB_ENGINE=postgresql), SQLite for local development.
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite")
+
+if DB_ENGINE == "postgresql":
+    # psycopg 3 connection pool per worker process. Django refuses persistent
+    # connections together with a pool, so CONN_MAX_AGE only applies when
+    # pooling is turned off with DB_POOL=0.
+    DB_POOL = os.environ.get("DB_POOL", "1") == "1"
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "social_network"),
+            "USER": os.environ.get("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", "localhost"),
+            "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+            "CONN_MAX_AGE": 0 if DB_POOL else int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "pool": {
+                    "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+                    "max_size": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+                    "timeout": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
+                },
+            } if DB_POOL else {},
+        }
     }
-}
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            "OPTIONS": {
+                # WAL lets readers run alongside the single writer; IMMEDIATE
+                # takes the write lock when a transaction starts instead of
+                # failing with "database is locked" when it upgrades later.
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA temp_store=MEMORY;"
+                    "PRAGMA cache_size=-20000;"
+                    "PRAGMA mmap_size=134217728;"
+                ),
+                "transaction_mode": "IMMEDIATE",
+                "timeout": 20,
+            },
+        }
+    }
+
+# Read replicas: comma-separated hosts for PostgreSQL, or database files for
+# SQLite (a copy of the primary can stand in for a replica locally).
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.environ.get("DB_REPLICAS", "").split(","))):
+    alias = f"replica_{index}"
+    DATABASES[alias] = copy.deepcopy(DATABASES["default"])
+    DATABASES[alias]["HOST" if DB_ENGINE == "postgresql" else "NAME"] = replica
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+
+# A "replica" alias for the primary itself. Nothing reads from it unless it is listed in DATABASE_REPLICAS, which the
+# router's tests do with override_settings(DATABASE_REPLICAS=["replica"]); it mirrors the primary in the test database.
+DATABASES["replica"] = {**copy.deepcopy(DATABASES["default"]), "TEST": {"MIRROR": "default"}}
+
+DATABASE_ROUTERS = ["users.routers.ReplicaRouter"]
+
+# How long a user's reads stay on the primary after they wrote
+REPLICA_STICKY_SECONDS = 5
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Server-sent friend request events: Redis fans them out across workers, otherwise they
+# only reach clients connected to the process that made the change.
+USER_EVENTS_BROKER = "users.events.RedisBroker" if REDIS_URL else "users.events.InMemoryBroker"
+USER_EVENTS_QUEUE_SIZE = 100
+USER_EVENTS_KEEPALIVE_SECONDS = 15
+USER_EVENTS_RETRY_SECONDS = 5
+
+# Read-through cache for friend sets, pending counts and user payloads
+USERS_CACHE_TIMEOUT = 300
+USERS_LOCAL_CACHE_SIZE = 10000
+USERS_LOCAL_CACHE_TTL = 5
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
     ),
+    # The browsable API costs a template render per request; only offer it while developing.
+    'DEFAULT_RENDERER_CLASSES': [
+        'users.renderers.ORJSONRenderer',
+        *(['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    ],
     'DEFAULT_THROTTLE_RATES': {
-        'friend_request': '3/minute',  # 3 requests per minute
+        # 3 requests per minute; benchmarks raise it through the environment
+        'friend_request': os.environ.get('FRIEND_REQUEST_THROTTLE_RATE', '3/minute'),
+        # Receivers per hour through the bulk endpoint, e.g. a contact list import in batches; each
+        # call also counts once against friend_request
+        'bulk_friend_request': os.environ.get('BULK_FRIEND_REQUEST_THROTTLE_RATE', '1000/hour'),
     },
 }
 
+# Maximum number of items accepted by the bulk friend request endpoints
+FRIEND_REQUEST_BATCH_SIZE = 500
+
+# Suggestions kept per user by compute_friend_suggestions, and the friend count above which
+# a friend is not followed when looking for friends of friends
+FRIEND_SUGGESTION_LIMIT = 20
+FRIEND_SUGGESTION_MAX_DEGREE = 1000
+# Friends followed when suggestions are worked out during a request, for a user the command has not reached yet
+FRIEND_SUGGESTION_LIVE_MAX_FRIENDS = 100
+
+# Days after which archive_friend_requests moves rejected requests, and accepted requests whose
+# friendship is recorded, out of FriendRequest. On PostgreSQL the archive table is partitioned by
+# month of created_at unless this is turned off before the migration creating it runs.
+FRIEND_REQUEST_ARCHIVE_REJECTED_DAYS = int(os.environ.get("FRIEND_REQUEST_ARCHIVE_REJECTED_DAYS", 90))
+FRIEND_REQUEST_ARCHIVE_ACCEPTED_DAYS = int(os.environ.get("FRIEND_REQUEST_ARCHIVE_ACCEPTED_DAYS", 30))
+FRIEND_REQUEST_ARCHIVE_PARTITIONED = os.environ.get("FRIEND_REQUEST_ARCHIVE_PARTITIONED", "1") == "1"
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -98,8 +221,68 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Revoked refresh tokens are cached by jti in the shared cache, in front of the RevokedToken table. The cached
+# set is reloaded from the table this often, in seconds, to restore entries the cache evicted.
+JWT_REVOKED_TOKENS_RELOAD_INTERVAL = int(os.environ.get("JWT_REVOKED_TOKENS_RELOAD_INTERVAL", 3600))
+
+# Build request.user from token claims instead of selecting the user on every request.
+# Set to False to load the user from the database as JWTAuthentication does.
+STATELESS_JWT_AUTHENTICATION = True
+# How long a user's active status is cached before a deactivation takes effect everywhere
+JWT_USER_ACTIVE_CACHE_TIMEOUT = 60
+
+# Most SQL queries a request to each view may run. Requests over budget are counted on the
+# metrics endpoint; with QUERY_BUDGET_STRICT=1 they raise instead, failing the request that made them.
+# QueryBudgetTests turn it on for themselves with override_settings.
+# Budgets allow for a cold cache, so the active user check is one of the queries: the lists add
+# their page and the cached user payloads (or the pending count), search its count and page.
+# Writes count their BEGIN/COMMIT; sending is highest when its insert hits the receiver's pending request
+# and it accepts that one instead.
+# Token refresh and logout allow for reloading the cached set of revoked tokens.
+# Suggestions allow for working them out, capped, for a user compute_friend_suggestions has not reached.
+QUERY_BUDGETS = {
+    "RefreshTokenView": 5,
+    "LogoutView": 4,
+    "UserSearchView": 3,
+    "FriendsListView": 3,
+    "MutualFriendsView": 4,
+    "FriendSuggestionsView": 7,
+    "PendingFriendRequestsView": 3,
+    "UserSummaryView": 2,
+    "SendFriendRequestView": 14,
+    "RespondFriendRequestView": 9,
+    "async_views.refresh_token": 5,
+    "async_views.logout": 4,
+    "async_views.search": 3,
+    "async_views.friends": 3,
+    "async_views.pending_friend_requests": 3,
+    "async_views.summary": 2,
+}
+QUERY_BUDGET_STRICT = os.environ.get("QUERY_BUDGET_STRICT", "0") == "1"
+
+# Bearer token Prometheus must send to read the metrics endpoint; leave empty to only serve it to staff users.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 AUTH_USER_MODEL = 'users.User'
 
+# Password hashing
+# https://docs.djangoproject.com/en/5.1/topics/auth/passwords/
+
+PASSWORD_HASHERS = [
+    "users.hashers.TunableArgon2PasswordHasher",
+    "users.hashers.TunableScryptPasswordHasher",
+    # Kept to verify hashes created before argon2; they are upgraded on login.
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+]
+
+PASSWORD_ARGON2_TIME_COST = int(os.environ.get("PASSWORD_ARGON2_TIME_COST", 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get("PASSWORD_ARGON2_MEMORY_COST", 19456))  # KiB
+PASSWORD_ARGON2_PARALLELISM = int(os.environ.get("PASSWORD_ARGON2_PARALLELISM", 1))
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.environ.get("PASSWORD_SCRYPT_WORK_FACTOR", 2 ** 14))
+
+# Threads hashing passwords for the async signup and login views
+PASSWORD_HASHING_WORKERS = int(os.environ.get("PASSWORD_HASHING_WORKERS", os.cpu_count() or 1))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
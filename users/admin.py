@@ -1,10 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 
-from users.models import FriendRequest
+from users.models import FriendRequest, Friendship
 
 User = get_user_model()
 
 # Register your models here.
 admin.site.register(User)
 admin.site.register(FriendRequest)
+admin.site.register(Friendship)
@@ -0,0 +1,110 @@
+"""
+Retention for answered friend requests. Rejected requests, and accepted ones
+whose friendship edges are recorded, are moved to ``ArchivedFriendRequest``
+so the indexes behind the pending, friends and duplicate checks only cover
+requests that can still change.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from .models import ArchivedFriendRequest, FriendRequest, Friendship
+
+ARCHIVE_TABLE = ArchivedFriendRequest._meta.db_table
+
+
+def rejected_requests(before):
+    return FriendRequest.objects.filter(status='rejected', created_at__lt=before)
+
+
+def compactable_requests(before):
+    # Both edges are written in the transaction that accepts, so one of them is enough.
+    return FriendRequest.objects.filter(status='accepted', created_at__lt=before).filter(Exists(
+        Friendship.objects.filter(user_id=OuterRef('sender_id'), friend_id=OuterRef('receiver_id'))
+    ))
+
+
+def archive_friend_requests(queryset):
+    """
+    Move the rows of ``queryset`` to the archive in one transaction and
+    return how many moved. Pass one batch at a time to keep it short.
+    """
+    with transaction.atomic():
+        # Locked and filtered again, so a request answered differently since it was picked stays put.
+        rows = list(queryset.select_for_update().values_list('id', 'sender_id', 'receiver_id', 'status', 'created_at'))
+        if not rows:
+            return 0
+        ensure_partitions(created_at for _, _, _, _, created_at in rows)
+        ArchivedFriendRequest.objects.bulk_create([
+            ArchivedFriendRequest(id=request_id, sender_id=sender_id, receiver_id=receiver_id, status=status,
+                                  created_at=created_at)
+            for request_id, sender_id, receiver_id, status, created_at in rows
+        ])
+        # Without the delete signals: archiving changes no list or count they would invalidate.
+        FriendRequest.objects.filter(id__in=[row[0] for row in rows])._raw_delete(queryset.db)
+    return len(rows)
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table JOIN pg_class ON pg_class.oid = partrelid WHERE relname = %s',
+            [ARCHIVE_TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(month):
+    return month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+
+
+def partition_name(month):
+    return f'{ARCHIVE_TABLE}_p{month:%Y%m}'
+
+
+def ensure_partitions(dates):
+    """Create the monthly partitions of a partitioned archive table that rows created at ``dates`` go to."""
+    if not is_partitioned():
+        return
+    months = {month_start(value.astimezone(dt_timezone.utc)) for value in dates}
+    with connection.cursor() as cursor:
+        for month in sorted(months):
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(partition_name(month))} '
+                f'PARTITION OF {connection.ops.quote_name(ARCHIVE_TABLE)} FOR VALUES FROM (%s) TO (%s)',
+                [month, next_month(month)]
+            )
+
+
+def purge_archived_friend_requests(before, batch_size):
+    """
+    Delete archived requests created before ``before``. Partitions wholly
+    before it are dropped, the rest is deleted in batches. Returns the number
+    of partitions dropped and of rows deleted.
+    """
+    dropped = 0
+    if is_partitioned():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = inhrelid '
+                'JOIN pg_class parent ON parent.oid = inhparent WHERE parent.relname = %s',
+                [ARCHIVE_TABLE]
+            )
+            for (name,) in cursor.fetchall():
+                month = datetime.strptime(name.removeprefix(f'{ARCHIVE_TABLE}_p'), '%Y%m')
+                if next_month(month.replace(tzinfo=dt_timezone.utc)) <= before:
+                    cursor.execute(f'DROP TABLE {connection.ops.quote_name(name)}')
+                    dropped += 1
+
+    deleted = 0
+    expired = ArchivedFriendRequest.objects.filter(created_at__lt=before).values_list('id', flat=True)
+    while batch := list(expired[:batch_size]):
+        deleted += ArchivedFriendRequest.objects.filter(id__in=batch).delete()[0]
+    return dropped, deleted
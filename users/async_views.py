@@ -0,0 +1,391 @@
+"""
+Async counterparts of the users API for the ASGI deployment. They use the
+async ORM for reads and run transactional writes, which Django only
+supports synchronously, through ``sync_to_async``.
+"""
+import json
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .authentication import aauthenticate
+from .cache import get_pending_count, get_user_payloads
+from .conditional import conditional_on_graph_version
+from .events import event_stream
+from .hashers import ahash_password, averify_password, run_in_hashing_pool
+from .models import FriendRequest, Friendship
+from .pagination import FriendsCursorPagination, PendingFriendRequestCursorPagination, UserSearchCursorPagination, \
+    UserSearchPagination, after_position
+from .routers import areplica_reads
+from .search import search_users
+from .serializers import CredentialsSerializer, SignupSerializer, FriendRequestSerializer, \
+    PendingFriendRequestSerializer, UserSerializer, UserSummarySerializer, RefreshTokenSerializer, LogoutSerializer
+from .services import respond_to_friend_request, send_friend_request
+from .throttles import FriendRequestThrottle
+from .utils import async_response, get_tokens_for_user
+
+User = get_user_model()
+
+
+def parse_json(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+@csrf_exempt
+@require_POST
+async def signup(request):
+    serializer = SignupSerializer(data=parse_json(request))
+    if not await sync_to_async(serializer.is_valid)():
+        return async_response(
+            data=None,
+            message="Signup failed.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": serializer.errors}
+        )
+
+    user = serializer.build_user(serializer.validated_data)
+    user.password = await ahash_password(serializer.validated_data['password'])
+    await user.asave()
+    return async_response(
+        data={"user": {"email": user.email, "name": user.name}, "tokens": get_tokens_for_user(user)},
+        message="User signed up successfully.",
+        status=status.HTTP_201_CREATED
+    )
+
+
+@csrf_exempt
+@require_POST
+async def login(request):
+    serializer = CredentialsSerializer(data=parse_json(request))
+    if not serializer.is_valid():
+        return async_response(
+            data=None,
+            message="Login failed.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": serializer.errors}
+        )
+
+    email = serializer.validated_data['email'].lower()
+    password = serializer.validated_data['password']
+    user = await User.objects.filter(email=email).afirst()
+    if user is None:
+        # Hash anyway so unknown emails take as long as wrong passwords.
+        await run_in_hashing_pool(make_password, password)
+    elif user.is_active and await averify_password(user, password):
+        return async_response(
+            data={"tokens": get_tokens_for_user(user)},
+            message="User logged in successfully.",
+            status=status.HTTP_200_OK
+        )
+    return async_response(
+        data=None,
+        message="Login failed.",
+        status=status.HTTP_400_BAD_REQUEST,
+        errors={"message": {"non_field_errors": ["Invalid credentials."]}}
+    )
+
+
+@csrf_exempt
+@require_POST
+async def refresh_token(request):
+    serializer = RefreshTokenSerializer(data=parse_json(request))
+    try:
+        valid = await sync_to_async(serializer.is_valid)()
+    except TokenError as error:
+        return async_response(
+            data=None,
+            message="Token refresh failed.",
+            status=status.HTTP_401_UNAUTHORIZED,
+            errors={"message": str(error)}
+        )
+    if valid:
+        return async_response(
+            data={"tokens": serializer.validated_data},
+            message="Token refreshed successfully.",
+            status=status.HTTP_200_OK
+        )
+    return async_response(
+        data=None,
+        message="Token refresh failed.",
+        status=status.HTTP_400_BAD_REQUEST,
+        errors={"message": serializer.errors}
+    )
+
+
+@csrf_exempt
+@require_POST
+async def logout(request):
+    serializer = LogoutSerializer(data=parse_json(request))
+    if not serializer.is_valid():
+        return async_response(
+            data=None,
+            message="Logout failed.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": serializer.errors}
+        )
+    try:
+        await sync_to_async(serializer.save)()
+    except TokenError as error:
+        return async_response(
+            data=None,
+            message="Logout failed.",
+            status=status.HTTP_401_UNAUTHORIZED,
+            errors={"message": str(error)}
+        )
+    return async_response(
+        data=None,
+        message="User logged out successfully.",
+        status=status.HTTP_200_OK
+    )
+
+
+def authenticated(view=None, *, query_param=None):
+    if view is None:
+        return partial(authenticated, query_param=query_param)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user_auth_tuple = await aauthenticate(request, query_param)
+        except (InvalidToken, AuthenticationFailed) as exc:
+            return unauthorized(exc.detail)
+        if user_auth_tuple is None:
+            return unauthorized("Authentication credentials were not provided.")
+        request.user, request.auth = user_auth_tuple
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def reads_from_replica(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        async with areplica_reads(request.user.id):
+            return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def unauthorized(detail):
+    response = JsonResponse({"detail": detail}, status=status.HTTP_401_UNAUTHORIZED)
+    response['WWW-Authenticate'] = 'Bearer realm="api"'
+    return response
+
+
+def page_size(request, pagination_class):
+    try:
+        size = int(request.GET['page_size'])
+    except (KeyError, ValueError):
+        return pagination_class.page_size
+    return max(1, min(size, pagination_class.max_page_size))
+
+
+def after_key(request):
+    value = request.GET.get('after', '')
+    return int(value) if value.isdigit() else None
+
+
+def search_after_key(request):
+    """The ``(rank, id)`` of the last match on the previous page of a ranked search."""
+    try:
+        rank, user_id = request.GET.get('after', '').split(',')
+        return float(rank), int(user_id)
+    except ValueError:
+        return None
+
+
+def keyset_page(request, rows, size, key):
+    """Keyset page of ``rows`` (fetched with one extra row) with ``after`` links."""
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, 'after', key(rows[size - 1])) if len(rows) > size else None
+    return {"next": next_url, "results": rows[:size]}
+
+
+@csrf_exempt
+@require_GET
+@authenticated
+@reads_from_replica
+async def search(request):
+    query = request.GET.get('q')
+    if query is None:
+        return async_response(data={"count": 0, "next": None, "previous": None, "results": []},
+                              message="User search results.")
+
+    queryset = search_users(query)
+    if request.GET.get('pagination') == 'cursor' or 'after' in request.GET:
+        # Keyset pages after the last (rank, id), without counting the matches.
+        size = UserSearchCursorPagination.page_size
+        if (after := search_after_key(request)) is not None:
+            queryset = queryset.filter(after_position(UserSearchCursorPagination.ordering, after))
+        rows = [row async for row in UserSerializer.values(queryset, 'search_rank')[:size + 1]]
+        page = keyset_page(request, rows, size, key=lambda row: f"{row['search_rank']},{row['id']}")
+        page["results"] = UserSerializer.from_values(page["results"])
+        return async_response(data=page, message="User search results.")
+
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    size = UserSearchPagination.page_size
+    count = await queryset.acount()
+    users = [row async for row in UserSerializer.values(queryset)[(page - 1) * size:page * size]]
+
+    url = request.build_absolute_uri()
+    return async_response(
+        data={
+            "count": count,
+            "next": replace_query_param(url, 'page', page + 1) if page * size < count else None,
+            "previous": (remove_query_param(url, 'page') if page == 2 else replace_query_param(url, 'page', page - 1))
+            if page > 1 else None,
+            "results": UserSerializer.from_values(users),
+        },
+        message="User search results."
+    )
+
+
+@csrf_exempt
+@require_GET
+@authenticated
+@reads_from_replica
+@conditional_on_graph_version
+async def friends(request):
+    size = page_size(request, FriendsCursorPagination)
+    queryset = Friendship.objects.filter(user_id=request.user.id).order_by('friend_id')
+    if (after := after_key(request)) is not None:
+        queryset = queryset.filter(friend_id__gt=after)
+
+    friend_ids = [friend_id async for friend_id in queryset.values_list('friend_id', flat=True)[:size + 1]]
+    payloads = await sync_to_async(get_user_payloads)(friend_ids[:size])
+    page = keyset_page(request, friend_ids, size, key=lambda friend_id: friend_id)
+    page["results"] = [payloads[friend_id] for friend_id in page["results"] if friend_id in payloads]
+    return async_response(data=page, message="List of friends retrieved successfully.")
+
+
+@csrf_exempt
+@require_GET
+@authenticated
+@reads_from_replica
+@conditional_on_graph_version
+async def pending_friend_requests(request):
+    size = page_size(request, PendingFriendRequestCursorPagination)
+    rows = []
+    if await sync_to_async(get_pending_count)(request.user.id):
+        queryset = PendingFriendRequestSerializer.eager_load(FriendRequest.objects.filter(
+            receiver_id=request.user.id, status='sent'
+        )).order_by('-id')
+        if (after := after_key(request)) is not None:
+            queryset = queryset.filter(id__lt=after)
+        rows = [friend_request async for friend_request in queryset[:size + 1]]
+
+    page = keyset_page(request, rows, size, key=lambda friend_request: friend_request.id)
+    page["results"] = PendingFriendRequestSerializer(page["results"], many=True).data
+    return async_response(data=page, message="List of pending friend requests retrieved successfully.")
+
+
+@csrf_exempt
+@require_GET
+@authenticated
+@reads_from_replica
+async def summary(request):
+    data = await UserSummarySerializer.values(User.objects.filter(pk=request.user.id)).afirst()
+    return async_response(data=data, message="Summary retrieved successfully.")
+
+
+@csrf_exempt
+@require_POST
+@authenticated
+async def send_request(request):
+    throttle = FriendRequestThrottle()
+    if not await sync_to_async(throttle.allow_request)(request, None):
+        response = JsonResponse({"detail": "Request was throttled."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if (wait := throttle.wait()) is not None:
+            response['Retry-After'] = str(int(wait) + 1)
+        return response
+
+    data = parse_json(request) or {}
+    serializer = FriendRequestSerializer(data={'receiver': data.get('receiver')}, context={'request': request})
+    if not await sync_to_async(serializer.is_valid)():
+        return async_response(
+            data=None,
+            message="Friend request failed.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": serializer.errors}
+        )
+
+    friend_request, outcome = await sync_to_async(send_friend_request)(
+        request.user, serializer.validated_data['receiver']
+    )
+    if outcome is None:
+        return async_response(
+            data=None,
+            message="Friend request failed.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": {"non_field_errors": ["A friend request has already been sent."]}}
+        )
+    return async_response(
+        data=FriendRequestSerializer(friend_request).data,
+        message=f"Friend request {outcome} successfully.",
+        status=status.HTTP_201_CREATED if outcome == 'sent' else status.HTTP_200_OK
+    )
+
+
+@csrf_exempt
+@require_http_methods(['PUT', 'PATCH'])
+@authenticated
+async def respond_request(request, pk):
+    friend_request = await FriendRequest.objects.filter(pk=pk).afirst()
+    if friend_request is None:
+        return JsonResponse({"detail": "No FriendRequest matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+    if friend_request.receiver_id != request.user.id:
+        return async_response(
+            data=None,
+            message="Unauthorized action.",
+            status=status.HTTP_403_FORBIDDEN,
+            errors={"message": "You are not allowed to respond to this friend request."}
+        )
+
+    action = (parse_json(request) or {}).get('action')
+    if action not in ('accept', 'reject'):
+        return async_response(
+            data=None,
+            message="Invalid action.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": "Action must be 'accept' or 'reject'."}
+        )
+    friend_request = await sync_to_async(respond_to_friend_request)(friend_request, action)
+    return async_response(
+        data={"status": friend_request.status},
+        message=f"Friend request {friend_request.status} successfully.",
+        status=status.HTTP_200_OK
+    )
+
+
+@require_GET
+@authenticated(query_param='token')
+async def events(request):
+    """
+    Server-sent events for the user: ``friend_request.received`` when someone
+    sends them a request, ``friend_request.accepted``/``rejected`` when a
+    request they sent is answered. Only useful under ASGI. The stream ends
+    when the access token expires; the client reconnects with a fresh one.
+    """
+    response = StreamingHttpResponse(
+        event_stream(request.user.id, request.auth['exp']), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,259 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import FriendRequest, Friendship, User
+from .routers import primary_reads
+from .utils import chunked
+
+
+class LocalLRUCache:
+    """
+    Small per-process LRU with a short TTL. It bounds how long a process can
+    serve an entry after another process invalidated it in the shared tier.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return False, None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TieredCache:
+    """
+    Read-through cache: per-process LRU in front of a shared Django cache
+    (Redis in production, local memory in development and tests).
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.timeout = getattr(settings, 'USERS_CACHE_TIMEOUT', 300)
+        self.local = LocalLRUCache(
+            maxsize=getattr(settings, 'USERS_LOCAL_CACHE_SIZE', 10000),
+            ttl=getattr(settings, 'USERS_LOCAL_CACHE_TTL', 5),
+        )
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+
+    def get_or_set(self, key, loader, timeout=None):
+        return self.get_many_or_set([key], lambda keys: {key: loader()}, timeout)[key]
+
+    def get_many_or_set(self, keys, loader, timeout=None):
+        """
+        Return ``{key: value}`` for ``keys``, calling ``loader(missing_keys)``
+        once for everything neither tier holds.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            hit, value = self.local.get(key)
+            if hit:
+                found[key] = value
+            else:
+                missing.append(key)
+        local_hits = len(found)
+
+        shared = self.shared.get_many(missing) if missing else {}
+        for key, value in shared.items():
+            self.local.set(key, value)
+        found.update(shared)
+        missing = [key for key in missing if key not in shared]
+
+        if missing:
+            # Never refill the shared tier from a replica that may lag behind an invalidation.
+            with primary_reads():
+                loaded = loader(missing)
+            if loaded:
+                self.shared.set_many(loaded, self.timeout if timeout is None else timeout)
+                for key, value in loaded.items():
+                    self.local.set(key, value)
+                found.update(loaded)
+
+        self._count(local_hits=local_hits, shared_hits=len(shared), misses=len(missing))
+        return found
+
+    def invalidate(self, *keys):
+        self.local.delete_many(keys)
+        self.shared.delete_many(keys)
+        self._count(invalidations=len(keys))
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'invalidations': 0}
+
+
+user_cache = TieredCache()
+
+
+def friend_ids_key(user_id):
+    return f'users:friend-ids:{user_id}'
+
+
+def pending_count_key(user_id):
+    return f'users:pending-count:{user_id}'
+
+
+def user_payload_key(user_id):
+    return f'users:payload:{user_id}'
+
+
+def user_active_key(user_id):
+    return f'users:active:{user_id}'
+
+
+def revoked_token_key(jti):
+    return f'users:revoked-token:{jti}'
+
+
+# Set while the revoked token keys hold every revocation, so a missing key means not revoked.
+REVOKED_TOKENS_LOADED_KEY = 'users:revoked-tokens:loaded'
+# Held by the one request reloading the set.
+REVOKED_TOKENS_RELOAD_LOCK_KEY = 'users:revoked-tokens:reload-lock'
+
+
+def graph_version_key(user_id):
+    return f'users:graph-version:{user_id}'
+
+
+def get_graph_version(user_id):
+    """
+    Nanosecond timestamp of the last change to ``user_id``'s friend requests.
+    Read from the shared tier only, so a bump is seen by every worker at once.
+    """
+    key = graph_version_key(user_id)
+    version = user_cache.shared.get(key)
+    if version is None:
+        # Unknown or evicted: start a new version, clients simply refetch once.
+        user_cache.shared.add(key, time.time_ns(), timeout=None)
+        version = user_cache.shared.get(key)
+    return version
+
+
+def bump_graph_versions(user_ids):
+    now = time.time_ns()
+    user_cache.shared.set_many({graph_version_key(user_id): now for user_id in user_ids}, timeout=None)
+
+
+def is_user_active(user_id):
+    """Whether ``user_id`` still exists and is active, rechecked every ``JWT_USER_ACTIVE_CACHE_TIMEOUT`` seconds."""
+    return user_cache.get_or_set(
+        user_active_key(user_id),
+        lambda: User.objects.filter(pk=user_id, is_active=True).exists(),
+        timeout=settings.JWT_USER_ACTIVE_CACHE_TIMEOUT
+    )
+
+
+def get_friend_ids(user_id):
+    """Sorted ids of ``user_id``'s friends."""
+    return user_cache.get_or_set(friend_ids_key(user_id), lambda: list(
+        Friendship.objects.filter(user_id=user_id).order_by('friend_id').values_list('friend_id', flat=True)
+    ))
+
+
+def get_many_friend_ids(user_ids):
+    """Sorted friend ids for each of ``user_ids``, loading every uncached list in one query per chunk."""
+    def load(keys):
+        ids = [key_ids[key] for key in keys]
+        friends = {user_id: [] for user_id in ids}
+        for chunk in chunked(ids, 500):
+            for user_id, friend_id in Friendship.objects.filter(user_id__in=chunk).order_by(
+                'user_id', 'friend_id'
+            ).values_list('user_id', 'friend_id'):
+                friends[user_id].append(friend_id)
+        return {friend_ids_key(user_id): friend_ids for user_id, friend_ids in friends.items()}
+
+    key_ids = {friend_ids_key(user_id): user_id for user_id in user_ids}
+    found = user_cache.get_many_or_set(list(key_ids), load)
+    return {key_ids[key]: friend_ids for key, friend_ids in found.items()}
+
+
+def get_pending_count(user_id):
+    return user_cache.get_or_set(
+        pending_count_key(user_id),
+        lambda: FriendRequest.objects.filter(receiver_id=user_id, status='sent').count()
+    )
+
+
+def get_user_payloads(user_ids):
+    """``UserSerializer`` payloads keyed by user id; unknown ids are left out."""
+    from .serializers import UserSerializer
+
+    def load(keys):
+        ids = [key_ids[key] for key in keys]
+        return {
+            user_payload_key(row['id']): row
+            for row in UserSerializer.from_values(UserSerializer.values(User.objects.filter(id__in=ids)))
+        }
+
+    key_ids = {user_payload_key(user_id): user_id for user_id in user_ids}
+    payloads = user_cache.get_many_or_set(list(key_ids), load)
+    return {key_ids[key]: payload for key, payload in payloads.items()}
+
+
+def invalidate_friend_requests(friend_requests):
+    """
+    Drop cached state derived from ``friend_requests`` once the surrounding
+    transaction commits, so a concurrent read cannot cache the old rows.
+    """
+    keys = set()
+    user_ids = set()
+    for friend_request in friend_requests:
+        keys.update((
+            friend_ids_key(friend_request.sender_id),
+            friend_ids_key(friend_request.receiver_id),
+            pending_count_key(friend_request.receiver_id),
+        ))
+        user_ids.update((friend_request.sender_id, friend_request.receiver_id))
+    if keys:
+        def invalidate():
+            user_cache.invalidate(*keys)
+            # After the commit, so a client never gets the new version with the old rows.
+            bump_graph_versions(user_ids)
+
+        transaction.on_commit(invalidate)
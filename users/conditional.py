@@ -0,0 +1,73 @@
+import hashlib
+import time
+from contextlib import nullcontext
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .cache import get_graph_version
+from .routers import primary_reads
+
+
+def graph_validators(request):
+    """
+    ``(etag, version)`` of a friends or pending list, the ETag derived from
+    the user's graph version and the exact page asked for. Costs one cache
+    lookup. There is no ``Last-Modified``: whole seconds cannot tell apart
+    two changes in the same second.
+    """
+    version = get_graph_version(request.user.id)
+    page = hashlib.md5(request.get_full_path().encode(), usedforsecurity=False).hexdigest()[:16]
+    return f'"{request.user.id}-{version}-{page}"', version
+
+
+def list_reads(version):
+    """
+    Reads for a list tagged with ``version``. A replica may not have the
+    change behind a recent version yet, and its stale rows would be cached by
+    the client under the new ETag, so those come from the primary. Replicas
+    are trusted to catch up within ``REPLICA_STICKY_SECONDS``, as for pinning.
+    """
+    if time.time_ns() - version < settings.REPLICA_STICKY_SECONDS * 1_000_000_000:
+        return primary_reads()
+    return nullcontext()
+
+
+def set_validators(response, etag):
+    response['ETag'] = etag
+    # Every poll must revalidate, and shared caches must not mix users up.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def not_modified(request, etag):
+    """A 304 response if the client's copy is current, otherwise ``None``."""
+    response = get_conditional_response(request, etag=etag)
+    return set_validators(response, etag) if response is not None else None
+
+
+class ConditionalListMixin:
+    """Answer ``If-None-Match`` with 304 before the list touches the database."""
+
+    def list(self, request, *args, **kwargs):
+        etag, version = graph_validators(request)
+        if (response := not_modified(request, etag)) is not None:
+            return response
+        with list_reads(version):
+            return set_validators(super().list(request, *args, **kwargs), etag)
+
+
+def conditional_on_graph_version(view):
+    """``ConditionalListMixin`` for the async views; apply below ``authenticated`` and ``reads_from_replica``."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        etag, version = await sync_to_async(graph_validators)(request)
+        if (response := not_modified(request, etag)) is not None:
+            return response
+        with list_reads(version):
+            return set_validators(await view(request, *args, **kwargs), etag)
+
+    return wrapper
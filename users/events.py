@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .renderers import dumps
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryBroker:
+    """
+    Fans events out to the subscribers connected to this process. Each
+    subscriber is an ``asyncio.Queue`` on the event loop serving it, so an
+    idle connection costs a queue and a suspended task, not a thread.
+
+    ``publish`` may be called from any thread, typically the one that ran
+    the committing transaction.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, event):
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client stopped reading; it resyncs from the pending list when it reconnects.
+            logger.warning('Dropping %s event for a subscriber that is not reading', event['type'])
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=settings.USER_EVENTS_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(user_id)
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+
+class RedisBroker(InMemoryBroker):
+    """
+    Publishes through Redis so events reach subscribers on every worker.
+    Each worker holds a single pattern subscription and fans messages out
+    to its local subscribers, however many connections it serves.
+    """
+    channel_prefix = 'users:events:'
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+        self._client = None
+
+    def publish(self, user_id, event):
+        import redis
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(settings.REDIS_URL)
+        self._client.publish(f'{self.channel_prefix}{user_id}', dumps(event))
+
+    async def _listen(self):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+        async with client.pubsub() as pubsub:
+            await pubsub.psubscribe(f'{self.channel_prefix}*')
+            async for message in pubsub.listen():
+                if message['type'] != 'pmessage':
+                    continue
+                user_id = int(message['channel'].decode().removeprefix(self.channel_prefix))
+                self.deliver(user_id, json.loads(message['data']))
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        async with super().subscribe(user_id) as queue:
+            yield queue
+
+
+@lru_cache
+def get_broker():
+    return import_string(settings.USER_EVENTS_BROKER)()
+
+
+def publish_on_commit(user_id, event_type, data):
+    event = {'type': event_type, 'data': data}
+    transaction.on_commit(lambda: get_broker().publish(user_id, event))
+
+
+def publish_friend_request_events(friend_requests):
+    """Tell the receiver about a new request, and the sender about an answer, once the change commits."""
+    from .serializers import PendingFriendRequestSerializer
+
+    for friend_request in friend_requests:
+        if friend_request.status == 'sent':
+            publish_on_commit(friend_request.receiver_id, 'friend_request.received',
+                              PendingFriendRequestSerializer(friend_request).data)
+        else:
+            publish_on_commit(friend_request.sender_id, f'friend_request.{friend_request.status}', {
+                'id': friend_request.id, 'receiver': friend_request.receiver_id, 'status': friend_request.status,
+            })
+
+
+def format_event(event):
+    return b'event: %s\ndata: %s\n\n' % (event['type'].encode(), dumps(event['data']))
+
+
+async def event_stream(user_id, expires_at):
+    """
+    Server-sent events for ``user_id`` until ``expires_at``, the Unix time
+    the access token that opened the stream expires, with a comment line
+    whenever the connection has been idle a while.
+    """
+    async with get_broker().subscribe(user_id) as queue:
+        yield b'retry: %d\n\n' % (settings.USER_EVENTS_RETRY_SECONDS * 1000)
+        while (remaining := expires_at - time.time()) > 0:
+            try:
+                event = await asyncio.wait_for(
+                    queue.get(), timeout=min(settings.USER_EVENTS_KEEPALIVE_SECONDS, remaining)
+                )
+            except asyncio.TimeoutError:
+                if remaining > settings.USER_EVENTS_KEEPALIVE_SECONDS:
+                    yield b': keepalive\n\n'
+                continue
+            yield format_event(event)
@@ -0,0 +1,62 @@
+import heapq
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+
+from .cache import get_friend_ids, get_many_friend_ids
+from .models import FriendRequest, FriendSuggestion
+from .utils import chunked
+
+# The cached sorted friend id lists are the adjacency lists: mutual friends and
+# friends of friends are set operations on them, never joins over FriendRequest.
+
+
+def mutual_friend_ids(user_id, other_id):
+    """Sorted ids of the friends ``user_id`` and ``other_id`` have in common."""
+    return sorted(set(get_friend_ids(user_id)).intersection(get_friend_ids(other_id)))
+
+
+def requested_ids(user_ids):
+    """For each of ``user_ids``, the users it has a friend request with in either direction, in any status."""
+    requested = defaultdict(set)
+    for sender_id, receiver_id in FriendRequest.objects.filter(
+        Q(sender_id__in=user_ids) | Q(receiver_id__in=user_ids)
+    ).values_list('sender_id', 'receiver_id'):
+        requested[sender_id].add(receiver_id)
+        requested[receiver_id].add(sender_id)
+    return requested
+
+
+def suggest_friends(user_id, limit=None, requested=None, max_friends=None):
+    """
+    Friends of ``user_id``'s friends ranked by how many friends they share,
+    as ``[(suggested_id, mutual_friends), ...]``. Friends with more than
+    ``FRIEND_SUGGESTION_MAX_DEGREE`` friends are not followed: a link through
+    a very popular user says little, and following it dominates the cost.
+    With ``max_friends``, only that many of the friends are followed.
+    """
+    limit = limit or settings.FRIEND_SUGGESTION_LIMIT
+    if requested is None:
+        requested = requested_ids([user_id])[user_id]
+
+    friend_ids = get_friend_ids(user_id)
+    counts = Counter()
+    for friends_of_friend in get_many_friend_ids(friend_ids[:max_friends]).values():
+        if len(friends_of_friend) <= settings.FRIEND_SUGGESTION_MAX_DEGREE:
+            counts.update(friends_of_friend)
+
+    for excluded in (user_id, *friend_ids, *requested):
+        counts.pop(excluded, None)
+    return heapq.nlargest(limit, counts.items(), key=lambda item: (item[1], -item[0]))
+
+
+def forget_suggestions(friend_requests):
+    """Drop suggestions between users who now have a request or a friendship with each other."""
+    # Chunked to keep each OR chain well within SQLite's expression depth limit.
+    for chunk in chunked(friend_requests, 200):
+        condition = Q()
+        for friend_request in chunk:
+            condition |= Q(user_id=friend_request.sender_id, suggested_id=friend_request.receiver_id)
+            condition |= Q(user_id=friend_request.receiver_id, suggested_id=friend_request.sender_id)
+        FriendSuggestion.objects.filter(condition).delete()
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher, check_password, make_password
+
+
+class TunableArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2 with its cost read from settings. Changing the cost makes
+    ``must_update`` true for existing hashes, so they are rehashed on login.
+    """
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+class TunableScryptPasswordHasher(ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hashing_executor():
+    """
+    Bounded pool for password hashing. argon2, scrypt and PBKDF2 release the
+    GIL, so threads hash in parallel without blocking the event loop.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_WORKERS, thread_name_prefix='password-hashing'
+            )
+    return _executor
+
+
+async def run_in_hashing_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_hashing_executor(), func, *args)
+
+
+async def ahash_password(password):
+    return await run_in_hashing_pool(make_password, password)
+
+
+async def averify_password(user, password):
+    """
+    Check ``password`` against ``user`` in the hashing pool, rehashing and
+    saving it when the stored hash uses outdated parameters.
+    """
+    rehashed = []
+
+    def verify():
+        return check_password(password, user.password, setter=lambda raw: rehashed.append(make_password(raw)))
+
+    valid = await run_in_hashing_pool(verify)
+    if valid and rehashed:
+        user.password = rehashed[0]
+        await user.asave(update_fields=['password'])
+    return valid
@@ -0,0 +1,61 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.archive import archive_friend_requests, compactable_requests, purge_archived_friend_requests, \
+    rejected_requests
+
+
+class Command(BaseCommand):
+    help = (
+        'Move rejected friend requests, and accepted ones whose friendship is recorded, out of the friend request '
+        'table into the archive, in short batches. Archived rejections no longer stop the pair sending a new '
+        'request, and archived acceptances can no longer be answered again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rejected-after', type=int, default=settings.FRIEND_REQUEST_ARCHIVE_REJECTED_DAYS,
+                            help='Archive rejected requests created this many days ago or earlier.')
+        parser.add_argument('--accepted-after', type=int, default=settings.FRIEND_REQUEST_ARCHIVE_ACCEPTED_DAYS,
+                            help='Archive accepted requests created this many days ago or earlier.')
+        parser.add_argument('--purge-after', type=int,
+                            help='Also delete archived requests created this many days ago or earlier.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to wait between batches, to leave the database room for live traffic.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        for label, candidates in (
+            ('rejected', rejected_requests(now - timedelta(days=options['rejected_after']))),
+            ('accepted', compactable_requests(now - timedelta(days=options['accepted_after']))),
+        ):
+            self.archive(label, candidates, options['batch_size'], options['sleep'])
+
+        if options['purge_after'] is not None:
+            dropped, deleted = purge_archived_friend_requests(
+                now - timedelta(days=options['purge_after']), options['batch_size']
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Purged {deleted} archived requests and dropped {dropped} archive partitions.'
+            ))
+
+    def archive(self, label, candidates, batch_size, sleep):
+        # Walks the ids upwards instead of re-running the filter from the start, so each batch is an index range.
+        ids = candidates.order_by('id').values_list('id', flat=True)
+        started = time.perf_counter()
+        last_id = 0
+        moved = 0
+        while batch := list(ids.filter(id__gt=last_id)[:batch_size]):
+            last_id = batch[-1]
+            moved += archive_friend_requests(candidates.filter(id__in=batch))
+            rate = moved / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f'\rArchived {moved} {label} requests ({rate:,.0f} rows/s)', ending='')
+            self.stdout.flush()
+            if sleep:
+                time.sleep(sleep)
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} {label} requests.'))
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from users.graph import requested_ids, suggest_friends
+from users.models import FriendSuggestion, User
+from users.utils import chunked
+
+
+class Command(BaseCommand):
+    help = 'Precompute the top friend suggestions of every user, or of the given users, into FriendSuggestion.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only this user id; repeatable.')
+        parser.add_argument('--limit', type=int, help='Suggestions kept per user; defaults to FRIEND_SUGGESTION_LIMIT.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user_ids = User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)
+        if options['users']:
+            user_ids = user_ids.filter(id__in=options['users'])
+
+        started = time.perf_counter()
+        done = 0
+        stored = 0
+        for chunk in chunked(user_ids.iterator(chunk_size=options['batch_size']), options['batch_size']):
+            requested = requested_ids(chunk)
+            suggestions = [
+                FriendSuggestion(user_id=user_id, suggested_id=suggested_id, mutual_friends=mutual_friends)
+                for user_id in chunk
+                for suggested_id, mutual_friends in suggest_friends(user_id, options['limit'], requested[user_id])
+            ]
+            # Readers see either the previous suggestions or the new ones, never an empty list.
+            with transaction.atomic():
+                FriendSuggestion.objects.filter(user_id__in=chunk).delete()
+                FriendSuggestion.objects.bulk_create(suggestions, ignore_conflicts=True)
+                User.objects.filter(id__in=chunk).update(suggestions_computed_at=timezone.now())
+
+            done += len(chunk)
+            stored += len(suggestions)
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f'\rUsers: {done} ({rate:,.0f} users/s)', ending='')
+            self.stdout.flush()
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'Stored {stored} suggestions for {done} users.'))
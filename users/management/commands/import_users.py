@@ -0,0 +1,250 @@
+import csv
+import json
+import os
+import time
+from collections import Counter
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+
+from users.cache import bump_graph_versions, friend_ids_key, user_cache
+from users.hashers import get_hashing_executor
+from users.models import FriendRequest, FriendSuggestion, Friendship, User
+from users.search import get_search_backend
+from users.serializers import SignupSerializer
+from users.services import reconcile_user_counters
+from users.utils import chunked
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def read_rows(path, file_format):
+    """Each record of a CSV file with a header row, or of a JSON lines file, as a dict."""
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            yield from csv.DictReader(file)
+            return
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                raise CommandError(f'{path}, line {number}: {error}')
+
+
+def normalize_email(value):
+    return (value or '').strip().lower()
+
+
+def insert(model, objs):
+    """
+    Insert ``objs``, skipping rows that conflict with a unique constraint.
+    PostgreSQL loads them with ``COPY`` into a staging table first, since
+    ``COPY`` itself cannot skip conflicts. Must run inside a transaction.
+    """
+    if connection.vendor != 'postgresql':
+        model.objects.bulk_create(objs, ignore_conflicts=True)
+        return
+
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE import_staging ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA')
+        with cursor.copy(f'COPY import_staging ({columns}) FROM STDIN') as copy:
+            for obj in objs:
+                copy.write_row([field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields])
+        cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM import_staging ON CONFLICT DO NOTHING')
+        cursor.execute('DROP TABLE import_staging')
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users, and accepted friendships between them, from CSV or JSON lines files. User records have '
+        'email, name and either password or a Django-encoded password_hash; friendship records have email and '
+        'friend_email. Existing users, and pairs that are already friends or have a friend request, are skipped, so '
+        'a run can be repeated, and a failed run resumes from its checkpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='?', help='Users file, .csv or .jsonl.')
+        parser.add_argument('--friendships', help='Friendships file, .csv or .jsonl, imported after the users.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format; defaults to the file extension.')
+        parser.add_argument('--unusable-passwords', action='store_true',
+                            help='Ignore passwords in the input; imported users set one with a password reset.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--checkpoint', help='Progress file; defaults to the first input file plus .checkpoint.')
+        parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start from the top.')
+
+    def handle(self, *args, **options):
+        if not options['users'] and not options['friendships']:
+            raise CommandError('Pass a users file, a --friendships file, or both.')
+        self.format = options['format']
+        self.batch_size = options['batch_size']
+        self.checkpoint_path = options['checkpoint'] or f"{options['users'] or options['friendships']}.checkpoint"
+        self.checkpoint = {}
+        if not options['restart'] and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as file:
+                self.checkpoint = json.load(file)
+
+        if options['users']:
+            self.import_users(options['users'], options['unusable_passwords'])
+        if options['friendships']:
+            self.import_friendships(options['friendships'])
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def file_format(self, path):
+        file_format = self.format or FORMATS.get(os.path.splitext(path)[1].lower())
+        if file_format is None:
+            raise CommandError(f'Cannot tell the format of {path}; pass --format.')
+        return file_format
+
+    def resume(self, stage, path):
+        """Records of ``path`` not yet imported by an earlier run, and how many that run got through."""
+        done = self.checkpoint.get(stage, {})
+        if done and done['path'] != os.path.abspath(path):
+            raise CommandError(f'{self.checkpoint_path} belongs to {done["path"]}; pass --restart to start over.')
+        skip = done.get('rows', 0)
+        if skip:
+            self.stdout.write(f'Resuming {stage} after row {skip}.')
+        return islice(read_rows(path, self.file_format(path)), skip, None), skip
+
+    def save_checkpoint(self, stage, path, rows):
+        # Written after each commit: a crash in between only means that batch is read again and skipped.
+        self.checkpoint[stage] = {'path': os.path.abspath(path), 'rows': rows}
+        with open(f'{self.checkpoint_path}.tmp', 'w') as file:
+            json.dump(self.checkpoint, file)
+        os.replace(f'{self.checkpoint_path}.tmp', self.checkpoint_path)
+
+    def progress(self, label, done, resumed_at, started, ending=''):
+        rate = (done - resumed_at) / max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f'\r{label}: {done} rows ({rate:,.0f} rows/s)', ending=ending)
+        self.stdout.flush()
+
+    def password_hashes(self, rows, unusable_passwords):
+        if unusable_passwords:
+            return [make_password(None) for _ in rows]
+        # argon2 releases the GIL, so the hashing pool's threads hash in parallel.
+        return list(get_hashing_executor().map(
+            lambda row: row.get('password_hash') or make_password(row.get('password') or None), rows
+        ))
+
+    def import_users(self, path, unusable_passwords):
+        rows, done = self.resume('users', path)
+        resumed_at = done
+        backend = get_search_backend()
+        build_user = SignupSerializer().build_user
+        stats = Counter()
+        started = time.perf_counter()
+
+        for chunk in chunked(rows, self.batch_size):
+            records = {}
+            valid = 0
+            for row in chunk:
+                email = normalize_email(row.get('email'))
+                try:
+                    validate_email(email)
+                except ValidationError:
+                    stats['invalid'] += 1
+                    continue
+                valid += 1
+                records.setdefault(email, row)
+            existing = set(User.objects.filter(email__in=records).values_list('email', flat=True))
+            records = {email: row for email, row in records.items() if email not in existing}
+            # Emails repeated within the file count as existing from their second row on.
+            stats['existing'] += valid - len(records)
+
+            # Hash before taking any lock, it is by far the slowest step.
+            users = []
+            for (email, row), encoded in zip(records.items(), self.password_hashes(records.values(), unusable_passwords)):
+                user = build_user({'email': email, 'name': row.get('name') or ''})
+                user.password = encoded
+                users.append(user)
+
+            with transaction.atomic():
+                insert(User, users)
+                # bulk_create skips the post_save signal that keeps the search index up to date.
+                backend.index(User.objects.filter(email__in=records).only('id', 'name'))
+            stats['created'] += len(users)
+            done += len(chunk)
+            self.save_checkpoint('users', path, done)
+            self.progress('Users', done, resumed_at, started)
+
+        self.progress('Users', done, resumed_at, started, ending='\n')
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {stats['created']} users; skipped {stats['existing']} existing and {stats['invalid']} invalid."
+        ))
+
+    def import_friendships(self, path):
+        rows, done = self.resume('friendships', path)
+        resumed_at = done
+        stats = Counter()
+        started = time.perf_counter()
+
+        for chunk in chunked(rows, self.batch_size):
+            emails = {normalize_email(row.get(key)) for row in chunk for key in ('email', 'friend_email')}
+            user_ids = dict(User.objects.filter(email__in=emails).values_list('email', 'id'))
+
+            pairs = {}
+            for row in chunk:
+                user_id = user_ids.get(normalize_email(row.get('email')))
+                friend_id = user_ids.get(normalize_email(row.get('friend_email')))
+                if user_id is None or friend_id is None or user_id == friend_id:
+                    stats['unresolved'] += 1
+                    continue
+                pairs.setdefault((min(user_id, friend_id), max(user_id, friend_id)), (user_id, friend_id))
+
+            # A pair that already has a request, in either direction and any status, keeps it, and so does a pair
+            # of friends whose accepted request has been archived. The other side is matched here: with both sides
+            # as IN lists SQLite probes the pair index for every combination.
+            involved = {user_id for pair in pairs for user_id in pair}
+            requested = {
+                (min(user_id, other_id), max(user_id, other_id))
+                for queryset in (
+                    FriendRequest.objects.filter(sender_id__in=involved).values_list('sender_id', 'receiver_id'),
+                    Friendship.objects.filter(user_id__in=involved).values_list('user_id', 'friend_id'),
+                )
+                for user_id, other_id in queryset
+                if other_id in involved
+            }
+            friend_requests = [
+                FriendRequest(sender_id=sender_id, receiver_id=receiver_id, status='accepted')
+                for key, (sender_id, receiver_id) in pairs.items() if key not in requested
+            ]
+            stats['existing'] += len(pairs) - len(friend_requests)
+            linked = sorted({user_id for request in friend_requests for user_id in (request.sender_id, request.receiver_id)})
+
+            with transaction.atomic():
+                insert(FriendRequest, friend_requests)
+                insert(Friendship, [
+                    Friendship(user_id=user_id, friend_id=friend_id)
+                    for request in friend_requests
+                    for user_id, friend_id in ((request.sender_id, request.receiver_id),
+                                               (request.receiver_id, request.sender_id))
+                ])
+                for user_ids in chunked(linked, 1000):
+                    # New friends make the precomputed suggestions stale; the view computes them live until
+                    # compute_friend_suggestions next runs.
+                    FriendSuggestion.objects.filter(user_id__in=user_ids).delete()
+                    User.objects.filter(id__in=user_ids).update(suggestions_computed_at=None)
+                    # Exact even if a concurrent request or another import touched the same users.
+                    reconcile_user_counters(user_ids)
+            if linked:
+                user_cache.invalidate(*[friend_ids_key(user_id) for user_id in linked])
+                bump_graph_versions(linked)
+            stats['created'] += len(friend_requests)
+            done += len(chunk)
+            self.save_checkpoint('friendships', path, done)
+            self.progress('Friendships', done, resumed_at, started)
+
+        self.progress('Friendships', done, resumed_at, started, ending='\n')
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {stats['created']} friendships; skipped {stats['existing']} pairs already friends or requested "
+            f"and {stats['unresolved']} rows with an unknown or repeated email."
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = 'Delete revoked refresh tokens that have expired, so the table only holds tokens that could still be used.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        # Their cache keys expire by themselves; the rows go in short batches so the table is never locked for long.
+        now = timezone.now()
+        expired = RevokedToken.objects.filter(expires_at__lte=now).values_list('jti', flat=True)
+        deleted = 0
+        while batch := list(expired[:options['batch_size']]):
+            deleted += RevokedToken.objects.filter(jti__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired revoked tokens.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from users.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the user search index from the users table.'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search index using {type(backend).__name__}.'))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.models import User
+from users.services import reconcile_user_counters
+from users.utils import chunked
+
+
+class Command(BaseCommand):
+    help = 'Recount every user\'s friend_count and pending_request_count, or the given users\', and repair drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only this user id; repeatable.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report drifted counters without repairing them.')
+
+    def handle(self, *args, **options):
+        user_ids = User.objects.order_by('id').values_list('id', flat=True)
+        if options['users']:
+            user_ids = user_ids.filter(id__in=options['users'])
+
+        started = time.perf_counter()
+        done = 0
+        drifted = 0
+        for chunk in chunked(user_ids.iterator(chunk_size=options['batch_size']), options['batch_size']):
+            for user_id, counters, recounted in reconcile_user_counters(chunk, dry_run=options['dry_run']):
+                drifted += 1
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'\rUser {user_id}: friends {counters[0]} -> {recounted[0]}, '
+                                      f'pending {counters[1]} -> {recounted[1]}')
+            done += len(chunk)
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f'\rUsers: {done} ({rate:,.0f} users/s)', ending='')
+            self.stdout.flush()
+        self.stdout.write('')
+        if options['dry_run']:
+            self.stdout.write(f'{drifted} of {done} users have drifted counters.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Repaired the counters of {drifted} of {done} users.'))
@@ -0,0 +1,151 @@
+import random
+import time
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from users.cache import user_cache
+from users.models import FriendRequest, Friendship, User
+from users.search import get_search_backend
+from users.services import reconcile_user_counters
+
+FIRST_NAMES = ['Ada', 'Alan', 'Anna', 'Ben', 'Clara', 'David', 'Elena', 'Felix', 'Grace', 'Hugo', 'Ines', 'Jonas',
+               'Karin', 'Liam', 'Maya', 'Nora', 'Omar', 'Paula', 'Rahul', 'Sofia', 'Tariq', 'Uma', 'Victor', 'Yara']
+LAST_NAMES = ['Anderson', 'Brown', 'Chen', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Hansen', 'Ivanova', 'Jensen',
+              'Kowalski', 'Lopez', 'Müller', 'Nakamura', 'Okafor', 'Patel', 'Rossi', 'Silva', 'Tanaka', 'Weber']
+
+
+def seed_email(index):
+    return f'seed-{index}@example.com'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed synthetic users and a friendship graph with power-law degrees, for benchmarks. '
+        'User seed-0@example.com has the highest degree and degrees fall off with the index.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--avg-degree', type=float, default=20,
+                            help='Mean number of friend requests each user takes part in.')
+        parser.add_argument('--exponent', type=float, default=2.5,
+                            help='Power-law exponent of the degree distribution; must be greater than 2.')
+        parser.add_argument('--pending-percent', type=int, default=10,
+                            help='Share of requests left pending; the rest are accepted.')
+        parser.add_argument('--password', default='benchmark-password')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, so a scale is reproducible.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete previously seeded users and clear the cache, since their ids may be reused.')
+
+    def handle(self, *args, **options):
+        if options['exponent'] <= 2:
+            raise CommandError('--exponent must be greater than 2 for the mean degree to be finite.')
+        if options['clear']:
+            deleted, _ = User.objects.filter(email__startswith='seed-', email__endswith='@example.com').delete()
+            user_cache.local.clear()
+            user_cache.shared.clear()
+            self.stdout.write(f'Deleted {deleted} seeded rows.')
+        if User.objects.filter(email=seed_email(0)).exists():
+            raise CommandError('Seeded users already exist; pass --clear to replace them.')
+
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        first_id = (User.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+        self.create_users(first_id, options['users'], options['password'])
+        self.create_edges(first_id, options['users'], options['avg_degree'], options['exponent'],
+                          options['pending_percent'])
+
+        self.log('Counting friends and pending requests', lambda: self.count_edges(first_id, options['users']))
+        self.log('Rebuilding search index', get_search_backend().rebuild)
+        if connection.vendor == 'postgresql':
+            self.log('Analyzing tables', self.analyze)
+
+    def log(self, label, func):
+        started = time.perf_counter()
+        func()
+        self.stdout.write(f'{label}: {time.perf_counter() - started:.1f}s')
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            for model in (User, FriendRequest, Friendship):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def progress(self, label, done, total, started):
+        rate = done / max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(f'\r{label}: {done}/{total} ({rate:,.0f} rows/s)', ending='')
+        self.stdout.flush()
+
+    def count_edges(self, first_id, count):
+        # The edges were bulk inserted around the services that keep the counters.
+        for start in range(first_id, first_id + count, self.batch_size):
+            reconcile_user_counters(list(range(start, min(start + self.batch_size, first_id + count))))
+
+    def create_users(self, first_id, count, password):
+        # Hashing once keeps seeding fast; every seeded user can still log in.
+        encoded = make_password(password)
+        started = time.perf_counter()
+        for start in range(0, count, self.batch_size):
+            User.objects.bulk_create([
+                User(
+                    id=first_id + index,
+                    email=seed_email(index),
+                    name=f'{FIRST_NAMES[index % len(FIRST_NAMES)]} '
+                         f'{LAST_NAMES[index // len(FIRST_NAMES) % len(LAST_NAMES)]} {index}',
+                    password=encoded,
+                )
+                for index in range(start, min(start + self.batch_size, count))
+            ])
+            self.progress('Users', min(start + self.batch_size, count), count, started)
+        self.stdout.write('')
+
+        # Ids were set explicitly, so move the sequence past them.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User]):
+                cursor.execute(sql)
+
+    def create_edges(self, first_id, count, avg_degree, exponent, pending_percent):
+        """
+        Chung-Lu graph: both ends of each edge are drawn with probability
+        proportional to ``(index + 1) ** (-1 / (exponent - 1))``, which gives a
+        power-law degree distribution with the requested mean.
+        """
+        weights = array('d', accumulate((index + 1) ** (-1 / (exponent - 1)) for index in range(count)))
+        total_weight = weights[-1]
+        edges = int(count * avg_degree / 2)
+
+        def pick():
+            return first_id + min(bisect_right(weights, self.random.random() * total_weight), count - 1)
+
+        started = time.perf_counter()
+        done = 0
+        while done < edges:
+            size = min(self.batch_size, edges - done)
+            requests = []
+            friendships = []
+            for _ in range(size):
+                sender, receiver = pick(), pick()
+                if sender == receiver:
+                    continue
+                # The status depends only on the pair, so a pair drawn twice cannot disagree with itself.
+                low, high = min(sender, receiver), max(sender, receiver)
+                pending = (low * 2654435761 + high) % 100 < pending_percent
+                requests.append(FriendRequest(sender_id=sender, receiver_id=receiver,
+                                              status='sent' if pending else 'accepted'))
+                if not pending:
+                    friendships.append(Friendship(user_id=sender, friend_id=receiver))
+                    friendships.append(Friendship(user_id=receiver, friend_id=sender))
+            with transaction.atomic():
+                FriendRequest.objects.bulk_create(requests, ignore_conflicts=True)
+                Friendship.objects.bulk_create(friendships, ignore_conflicts=True)
+            done += size
+            self.progress('Friend requests', done, edges, started)
+        self.stdout.write('')
@@ -1,4 +1,6 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.db import models
+from django.db.models import Case, F, Q, Value, When
 
 
 class CustomUserManager(BaseUserManager):
@@ -16,3 +18,53 @@ class CustomUserManager(BaseUserManager):
         extra_fields.setdefault('is_superuser', True)
 
         return self.create_user(email, password, **extra_fields)
+
+    def add_to_counters(self, deltas):
+        """Apply ``deltas``, ``{field: {user_id: delta}}``, to the users' counter fields in one UPDATE."""
+        updates = {}
+        user_ids = set()
+        for field, field_deltas in deltas.items():
+            changed = {user_id: delta for user_id, delta in field_deltas.items() if delta}
+            if changed:
+                updates[field] = F(field) + Case(
+                    *[When(id=user_id, then=Value(delta)) for user_id, delta in changed.items()], default=Value(0)
+                )
+                user_ids.update(changed)
+        if updates:
+            self.filter(id__in=sorted(user_ids)).update(**updates)
+
+
+class FriendRequestManager(models.Manager):
+    def accept_pending(self, receiver_id, sender_ids):
+        """
+        Accept the requests still pending from ``sender_ids`` to ``receiver_id``
+        and return them. Must run inside a transaction.
+        """
+        pending = list(self.select_for_update().filter(receiver_id=receiver_id, sender_id__in=sender_ids, status='sent'))
+        for friend_request in pending:
+            friend_request.status = 'accepted'
+        self.bulk_update(pending, ['status'])
+        return pending
+
+
+class FriendshipManager(models.Manager):
+    def link(self, user_id, friend_id):
+        self.link_many([(user_id, friend_id)])
+
+    def link_many(self, pairs):
+        # One edge per direction, so either side's friends are a single indexed lookup.
+        self.bulk_create([
+            self.model(user_id=user_id, friend_id=friend_id)
+            for a, b in pairs
+            for user_id, friend_id in ((a, b), (b, a))
+        ], ignore_conflicts=True)
+
+    def unlink(self, user_id, friend_id):
+        self.unlink_many([(user_id, friend_id)])
+
+    def unlink_many(self, pairs):
+        condition = Q()
+        for a, b in pairs:
+            condition |= Q(user_id=a, friend_id=b) | Q(user_id=b, friend_id=a)
+        if condition:
+            self.filter(condition).delete()
@@ -0,0 +1,125 @@
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_request_queries = ContextVar('request_queries', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+def collect_query(execute, sql, params, many, context):
+    """``execute_wrapper`` that times queries for the request being measured, if any."""
+    stats = _request_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - start
+
+
+def install_query_collector(sender, connection, **kwargs):
+    # Connected to ``connection_created``; a reconnecting wrapper keeps its list.
+    if collect_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(collect_query)
+
+
+def measure_queries(stats=None):
+    """
+    Start counting queries in the current context, or keep adding to ``stats``.
+    The context is copied into ``sync_to_async`` threads, so async views are
+    measured too.
+    """
+    stats = QueryStats() if stats is None else stats
+    return stats, _request_queries.set(stats)
+
+
+def stop_measuring_queries(token):
+    _request_queries.reset(token)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Per-process request metrics, rendered in the Prometheus text format.
+    Each worker reports its own numbers; Prometheus sums them per instance.
+    """
+    histograms = {
+        'users_request_duration_seconds': ('Total time spent handling the request.', LATENCY_BUCKETS),
+        'users_request_db_duration_seconds': ('Time spent executing SQL queries.', LATENCY_BUCKETS),
+        'users_request_render_duration_seconds': ('Time spent rendering the response body.', LATENCY_BUCKETS),
+        'users_request_db_queries': ('SQL queries executed per request.', QUERY_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {name: {} for name in self.histograms}
+            self._budget_exceeded = {}
+
+    def observe(self, view, **values):
+        with self._lock:
+            for name, value in values.items():
+                series = self._histograms[name]
+                if view not in series:
+                    series[view] = Histogram(self.histograms[name][1])
+                series[view].observe(value)
+
+    def budget_exceeded(self, view):
+        with self._lock:
+            self._budget_exceeded[view] = self._budget_exceeded.get(view, 0) + 1
+
+    def render(self, cache_stats=None):
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets) in self.histograms.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for view, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip((*buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{view="{view}"}} {cumulative}')
+
+            lines += ['# HELP users_query_budget_exceeded_total Requests that ran more queries than QUERY_BUDGETS allows.',
+                      '# TYPE users_query_budget_exceeded_total counter']
+            for view, count in sorted(self._budget_exceeded.items()):
+                lines.append(f'users_query_budget_exceeded_total{{view="{view}"}} {count}')
+
+        if cache_stats is not None:
+            lines += ['# HELP users_cache_operations_total Tiered user cache lookups and invalidations.',
+                      '# TYPE users_cache_operations_total counter']
+            for result, count in sorted(cache_stats.items()):
+                lines.append(f'users_cache_operations_total{{result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
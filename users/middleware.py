@@ -0,0 +1,172 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import QueryBudgetExceeded, measure_queries, registry, stop_measuring_queries
+from .routers import apin_to_primary, pin_to_primary
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _writer_id(request, response):
+    if request.method in SAFE_METHODS or response.status_code >= 400:
+        return None
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+class PrimaryPinMiddleware:
+    """
+    After a successful write by an authenticated user, pin that user's reads
+    to the primary for ``REPLICA_STICKY_SECONDS`` so they read their own writes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if (user_id := _writer_id(request, response)) is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if (user_id := _writer_id(request, response)) is not None:
+            await apin_to_primary(user_id)
+        return response
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class is not None:
+        return view_class.__name__
+    return f"{match.func.__module__.rsplit('.', 1)[-1]}.{match.func.__name__}"
+
+
+class RequestMetricsMiddleware:
+    """
+    Records query count, database time, render time and total latency per
+    view, reports them in a ``Server-Timing`` header and checks the query
+    count against ``QUERY_BUDGETS``.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        queries, token = measure_queries()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_measuring_queries(token)
+        return self.record(request, response, queries, start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        queries, token = measure_queries()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_measuring_queries(token)
+        return self.record(request, response, queries, start)
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook; time it until the post-render callback.
+        request._render_started = time.perf_counter()
+
+        def rendered(response):
+            request._render_duration = time.perf_counter() - request._render_started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, queries, start):
+        view = view_name(request)
+        duration = time.perf_counter() - start
+        render = getattr(request, '_render_duration', 0.0)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={queries.duration * 1000:.2f};desc="{queries.count} queries"',
+            f'render;dur={render * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f}',
+        ))
+        if response.streaming:
+            response.streaming_content = self.measure_stream(
+                response.streaming_content, response.is_async, view, queries, start
+            )
+            return response
+
+        self.observe(view, queries, duration, render)
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(view)
+        if budget is not None and queries.count > budget:
+            registry.budget_exceeded(view)
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(f'{view} ran {queries.count} queries, its budget is {budget}.')
+        return response
+
+    def observe(self, view, queries, duration, render):
+        registry.observe(
+            view,
+            users_request_duration_seconds=duration,
+            users_request_db_duration_seconds=queries.duration,
+            users_request_render_duration_seconds=render,
+            users_request_db_queries=queries.count,
+        )
+
+    def measure_stream(self, streaming_content, is_async, view, queries, start):
+        """
+        Keep counting queries while a streamed body is written and observe the
+        request once it is done. The header above only covers the view itself,
+        and budgets are not checked: a streamed list's queries grow with its length.
+        """
+        if is_async:
+            async def content():
+                chunks = aiter(streaming_content)
+                try:
+                    while True:
+                        _, token = measure_queries(queries)
+                        try:
+                            chunk = await anext(chunks, None)
+                        finally:
+                            stop_measuring_queries(token)
+                        if chunk is None:
+                            return
+                        yield chunk
+                finally:
+                    self.observe(view, queries, time.perf_counter() - start, 0.0)
+
+            return content()
+
+        def content():
+            chunks = iter(streaming_content)
+            try:
+                while True:
+                    _, token = measure_queries(queries)
+                    try:
+                        chunk = next(chunks, None)
+                    finally:
+                        stop_measuring_queries(token)
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                self.observe(view, queries, time.perf_counter() - start, 0.0)
+
+        return content()
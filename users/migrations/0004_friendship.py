@@ -0,0 +1,44 @@
+# Generated by Django 5.1 on 2026-10-18 15:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_friendships(apps, schema_editor):
+    FriendRequest = apps.get_model('users', 'FriendRequest')
+    Friendship = apps.get_model('users', 'Friendship')
+    db_alias = schema_editor.connection.alias
+
+    accepted = FriendRequest.objects.using(db_alias).filter(status='accepted').values_list('sender_id', 'receiver_id')
+    edges = []
+    for sender_id, receiver_id in accepted.iterator(chunk_size=2000):
+        edges.append(Friendship(user_id=sender_id, friend_id=receiver_id))
+        edges.append(Friendship(user_id=receiver_id, friend_id=sender_id))
+        if len(edges) >= 2000:
+            Friendship.objects.using(db_alias).bulk_create(edges, ignore_conflicts=True)
+            edges = []
+    Friendship.objects.using(db_alias).bulk_create(edges, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_email_lower_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Friendship',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('friend', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friend_of', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='friendships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'friend'), name='users_friendship_unique_edge')],
+            },
+        ),
+        migrations.RunPython(backfill_friendships, migrations.RunPython.noop),
+    ]
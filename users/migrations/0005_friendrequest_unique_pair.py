@@ -0,0 +1,43 @@
+# Generated by Django 5.1 on 2026-10-18 15:49
+
+from collections import defaultdict
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+# When both directions exist, keep the accepted request, else the pending one, else the oldest.
+STATUS_PRIORITY = {'accepted': 0, 'sent': 1, 'rejected': 2}
+
+
+def drop_reverse_duplicates(apps, schema_editor):
+    FriendRequest = apps.get_model('users', 'FriendRequest')
+    db_alias = schema_editor.connection.alias
+
+    reverse = FriendRequest.objects.using(db_alias).filter(sender=OuterRef('receiver'), receiver=OuterRef('sender'))
+    pairs = defaultdict(list)
+    for row in FriendRequest.objects.using(db_alias).filter(Exists(reverse)).values('id', 'sender_id', 'receiver_id',
+                                                                                      'status'):
+        pairs[frozenset((row['sender_id'], row['receiver_id']))].append(row)
+
+    duplicates = []
+    for rows in pairs.values():
+        rows.sort(key=lambda row: (STATUS_PRIORITY.get(row['status'], 3), row['id']))
+        duplicates.extend(row['id'] for row in rows[1:])
+    for start in range(0, len(duplicates), 500):
+        FriendRequest.objects.using(db_alias).filter(id__in=duplicates[start:start + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_friendship'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_reverse_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='friendrequest',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Least('sender', 'receiver'), django.db.models.functions.comparison.Greatest('sender', 'receiver'), name='users_friendrequest_unique_pair'),
+        ),
+    ]
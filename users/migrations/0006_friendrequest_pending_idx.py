@@ -0,0 +1,17 @@
+# Generated by Django 5.1 on 2026-10-18 15:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_friendrequest_unique_pair'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(condition=models.Q(('status', 'sent')), fields=['receiver', '-id'], name='users_fr_pending_receiver_idx'),
+        ),
+    ]
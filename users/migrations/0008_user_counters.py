@@ -0,0 +1,45 @@
+# Generated by Django 5.1 on 2026-10-18 16:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    FriendRequest = apps.get_model('users', 'FriendRequest')
+    Friendship = apps.get_model('users', 'Friendship')
+    db_alias = schema_editor.connection.alias
+
+    def count(queryset, field):
+        return Coalesce(Subquery(
+            queryset.using(db_alias).filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+                count=Count('pk')
+            ).values('count')
+        ), 0)
+
+    User.objects.using(db_alias).update(
+        friend_count=count(Friendship.objects.all(), 'user'),
+        pending_request_count=count(FriendRequest.objects.filter(status='sent'), 'receiver'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_friendsuggestion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='friend_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='pending_request_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1 on 2026-10-18 16:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_archive_table(apps, schema_editor):
+    model = apps.get_model('users', 'ArchivedFriendRequest')
+    if schema_editor.connection.vendor != 'postgresql' or not settings.FRIEND_REQUEST_ARCHIVE_PARTITIONED:
+        schema_editor.create_model(model)
+        return
+    # Range partitioned by month; archive_friend_requests adds partitions as rows arrive and drops whole
+    # ones when purging. The partition key has to be part of the primary key.
+    schema_editor.execute("""
+        CREATE TABLE users_archivedfriendrequest (
+            id bigint NOT NULL,
+            sender_id bigint NOT NULL REFERENCES users_user (id) DEFERRABLE INITIALLY DEFERRED,
+            receiver_id bigint NOT NULL REFERENCES users_user (id) DEFERRABLE INITIALLY DEFERRED,
+            status varchar(10) NOT NULL,
+            created_at timestamp with time zone NOT NULL,
+            archived_at timestamp with time zone NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    schema_editor.execute('CREATE INDEX users_archivedfr_sender_idx ON users_archivedfriendrequest (sender_id)')
+    schema_editor.execute('CREATE INDEX users_archivedfr_receiver_idx ON users_archivedfriendrequest (receiver_id)')
+
+
+def drop_archive_table(apps, schema_editor):
+    # Dropping a partitioned table drops its partitions too.
+    schema_editor.delete_model(apps.get_model('users', 'ArchivedFriendRequest'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_revoked_tokens'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ArchivedFriendRequest',
+                    fields=[
+                        ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                        ('status', models.CharField(choices=[('sent', 'Sent'), ('accepted', 'Accepted'), ('rejected', 'Rejected')], max_length=10)),
+                        ('created_at', models.DateTimeField()),
+                        ('archived_at', models.DateTimeField(auto_now_add=True)),
+                        ('receiver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                        ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                    ],
+                ),
+            ],
+        ),
+        migrations.RunPython(create_archive_table, drop_archive_table),
+    ]
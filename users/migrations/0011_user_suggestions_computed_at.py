@@ -0,0 +1,32 @@
+# Generated by Django 5.1 on 2026-10-18 16:43
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_suggestions_computed_at(apps, schema_editor):
+    # Users with stored suggestions have been computed; the rest wait for the next run.
+    User = apps.get_model('users', 'User')
+    FriendSuggestion = apps.get_model('users', 'FriendSuggestion')
+    db_alias = schema_editor.connection.alias
+    User.objects.using(db_alias).update(suggestions_computed_at=Subquery(
+        FriendSuggestion.objects.using(db_alias).filter(user_id=OuterRef('pk')).order_by('computed_at').values(
+            'computed_at'
+        )[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_archivedfriendrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='suggestions_computed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_suggestions_computed_at, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,9 @@
-from datetime import timedelta
-
 from django.conf import settings
 from django.contrib.auth.models import BaseUserManager, AbstractUser
 from django.db import models
-from django.utils import timezone
+from django.db.models.functions import Greatest, Least, Lower
 
-from users.managers import CustomUserManager
+from users.managers import CustomUserManager, FriendRequestManager, FriendshipManager
 
 
 class User(AbstractUser):
@@ -13,6 +11,12 @@ class User(AbstractUser):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Denormalized for badge counts; kept in step by the friend request services and
+    # repaired by the reconcile_user_counters command.
+    friend_count = models.IntegerField(default=0)
+    pending_request_count = models.IntegerField(default=0)
+    # Set by compute_friend_suggestions, so an empty precomputed list is told apart from one never computed.
+    suggestions_computed_at = models.DateTimeField(null=True, blank=True)
 
     username = None
 
@@ -21,6 +25,11 @@ class User(AbstractUser):
 
     objects = CustomUserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(Lower('email'), name='users_user_email_lower_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -33,14 +42,74 @@ class FriendRequest(models.Model):
                               default='sent')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = FriendRequestManager()
+
     class Meta:
         unique_together = ('sender', 'receiver')
+        constraints = [
+            # At most one request per unordered pair, so A->B and B->A cannot coexist.
+            models.UniqueConstraint(Least('sender', 'receiver'), Greatest('sender', 'receiver'),
+                                    name='users_friendrequest_unique_pair'),
+        ]
+        indexes = [
+            # Pending list, pending count and accepting a reverse request: the receiver's 'sent' rows,
+            # newest first, without reading the answered requests that make up most of the table.
+            models.Index(fields=['receiver', '-id'], condition=models.Q(status='sent'),
+                         name='users_fr_pending_receiver_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender} -> {self.receiver} ({self.status})"
 
-    @classmethod
-    def can_send_request(cls, user):
-        one_minute_ago = timezone.now() - timedelta(minutes=1)
-        recent_requests = cls.objects.filter(sender=user, created_at__gte=one_minute_ago)
-        return recent_requests.count() < 3
+
+class ArchivedFriendRequest(models.Model):
+    # Answered requests moved out of FriendRequest by archive_friend_requests, under their original ids.
+    id = models.BigIntegerField(primary_key=True)
+    sender = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    receiver = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=FriendRequest._meta.get_field('status').choices)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sender} -> {self.receiver} ({self.status}, archived)"
+
+
+class Friendship(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='friendships', on_delete=models.CASCADE)
+    friend = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='friend_of', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = FriendshipManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'friend'], name='users_friendship_unique_edge'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} <-> {self.friend}"
+
+
+class FriendSuggestion(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='friend_suggestions', on_delete=models.CASCADE)
+    suggested = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    mutual_friends = models.PositiveIntegerField()
+    computed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'suggested'], name='users_friendsuggestion_unique_pair'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} -> {self.suggested} ({self.mutual_friends} mutual)"
+
+
+class RevokedToken(models.Model):
+    # Refresh tokens revoked before they expire; rows are useless once expires_at has passed.
+    jti = models.CharField(max_length=255, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.jti
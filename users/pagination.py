@@ -0,0 +1,102 @@
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination, _reverse_ordering
+
+
+def after_position(ordering, position):
+    """
+    ``Q`` for the rows that come after the row whose ``ordering`` values are
+    ``position``, the last of them unique: past it on the first value that
+    differs.
+    """
+    after = Q()
+    tied = Q()
+    for order, value in zip(ordering, position):
+        field = order.lstrip('-')
+        after |= tied & Q(**{f'{field}__{"lt" if order.startswith("-") else "gt"}': value})
+        tied &= Q(**{field: value})
+    return after
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination on every field of ``ordering`` rather than the first
+    only. The cursor holds all of the last row's values, so rows tied on the
+    leading fields are neither skipped nor repeated and no offset is needed.
+    The values must not contain commas.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = None if self.cursor is None else self.cursor.position
+
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            values = position.split(',')
+            if len(values) != len(ordering):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                queryset = queryset.filter(after_position(ordering, values))
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # One extra row tells whether there is a page after this one.
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(results[-1], self.ordering) if len(results) > self.page_size \
+            else None
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None, position
+        self.display_page_controls = (self.has_previous or self.has_next) and self.template is not None
+        return self.page
+
+    def _get_position_from_instance(self, instance, ordering):
+        return ','.join(
+            str(instance[order.lstrip('-')] if isinstance(instance, dict) else getattr(instance, order.lstrip('-')))
+            for order in ordering
+        )
+
+
+class UserSearchPagination(PageNumberPagination):
+    page_size = 10
+
+
+class UserSearchCursorPagination(KeysetCursorPagination):
+    # Keyset pagination does not need a COUNT(*) over the matches.
+    page_size = 10
+    ordering = ('-search_rank', 'id')
+
+
+class FriendsCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = 'friend_id'
+
+
+class MutualFriendsPagination(PageNumberPagination):
+    # Mutual friends are intersected in memory, so pages slice a list rather than a queryset.
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class PendingFriendRequestCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-id'
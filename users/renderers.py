@@ -0,0 +1,58 @@
+import re
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Datetimes go through DRF's encoder, which writes UTC as 'Z' where orjson writes '+00:00'.
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+_encoder = JSONEncoder()
+
+# orjson writes float exponents as 1e-7 and 1e16 where the stdlib writes 1e-07 and 1e+16. Output that may hold
+# one, if only inside a string, is encoded again by the stdlib to keep the bytes the same.
+_EXPONENT = re.compile(rb'[0-9]e[-+]?[0-9]')
+
+
+def _escape_line_separators(content):
+    # Same as JSONRenderer: U+2028/U+2029 are valid JSON but end a line in JavaScript.
+    return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def _stdlib_dumps(value):
+    return JSONRenderer().render(value)
+
+
+def dumps(value):
+    """
+    ``value`` as the bytes DRF's ``JSONRenderer`` produces with the default
+    compact, unicode settings, encoded with orjson when it is installed.
+    Values orjson rejects, such as integers beyond 64 bits, and floats it
+    would write in exponent notation fall back to the stdlib encoder.
+    """
+    if orjson is None:
+        return _stdlib_dumps(value)
+    try:
+        content = orjson.dumps(value, default=_encoder.default, option=ORJSON_OPTIONS)
+    except TypeError:
+        return _stdlib_dumps(value)
+    if _EXPONENT.search(content):
+        return _stdlib_dumps(value)
+    return _escape_line_separators(content)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """Drop-in ``JSONRenderer`` that encodes with orjson; indented output is left to the stdlib."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent or not api_settings.COMPACT_JSON or not api_settings.UNICODE_JSON:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
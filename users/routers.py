@@ -0,0 +1,78 @@
+import random
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+_read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def primary_pin_key(user_id):
+    return f'db:primary-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Send ``user_id``'s reads to the primary for a while after they wrote."""
+    cache.set(primary_pin_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+async def apin_to_primary(user_id):
+    await cache.aset(primary_pin_key(user_id), True, settings.REPLICA_STICKY_SECONDS)
+
+
+@contextmanager
+def _reads(replica):
+    token = _read_from_replica.set(replica)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+def replica_reads(user_id=None):
+    """Route reads inside the block to a replica, unless ``user_id`` recently wrote."""
+    pinned = user_id is not None and cache.get(primary_pin_key(user_id), False)
+    return _reads(bool(settings.DATABASE_REPLICAS) and not pinned)
+
+
+@asynccontextmanager
+async def areplica_reads(user_id=None):
+    pinned = user_id is not None and await cache.aget(primary_pin_key(user_id), False)
+    with _reads(bool(settings.DATABASE_REPLICAS) and not pinned):
+        yield
+
+
+def primary_reads():
+    return _reads(False)
+
+
+def current_reads():
+    """Routing in effect now, to re-enter from code that runs after its block has exited."""
+    return partial(_reads, _read_from_replica.get())
+
+
+class ReplicaRouter:
+    """
+    Reads go to a random replica inside ``replica_reads()`` blocks and to the
+    primary everywhere else; writes and migrations always go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,156 @@
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Exists, F, FloatField, Lookup, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Lower
+from django.utils.module_loading import import_string
+
+User = get_user_model()
+
+DEFAULT_BACKENDS = {
+    'sqlite': 'users.search.SQLiteFTSSearchBackend',
+    'postgresql': 'users.search.PostgresTrigramSearchBackend',
+}
+
+
+class BaseSearchBackend:
+    """
+    Plain ``icontains`` matching, used on databases without a dedicated index.
+
+    Backends expose the name match and its rank as expressions so views can
+    combine them with other filters in a single query.
+    """
+
+    def match(self, query):
+        return Q(name__icontains=query)
+
+    def rank(self, query):
+        return Value(0.0, output_field=FloatField())
+
+    def search(self, queryset, query):
+        return queryset.filter(self.match(query)).annotate(
+            search_rank=self.rank(query)
+        ).order_by('-search_rank', 'id')
+
+    def index(self, users):
+        pass
+
+    def remove(self, user_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """
+    Matches names through an FTS5 table using the trigram tokenizer, which
+    answers substring queries from the index instead of scanning users.
+    """
+    table = 'users_user_fts'
+    # The trigram tokenizer cannot match queries shorter than one trigram.
+    min_query_length = 3
+
+    def _fts_query(self, query):
+        return '"%s"' % query.replace('"', '""')
+
+    def match(self, query):
+        if len(query) < self.min_query_length:
+            return super().match(query)
+        return Q(id__in=RawSQL(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s',
+            [self._fts_query(query)]
+        ))
+
+    def rank(self, query):
+        if len(query) < self.min_query_length:
+            return super().rank(query)
+        # bm25 ranks are negative, lower is better.
+        return RawSQL(
+            f'SELECT -rank FROM {self.table} WHERE {self.table} MATCH %s AND rowid = "{User._meta.db_table}"."id"',
+            [self._fts_query(query)],
+            output_field=FloatField()
+        )
+
+    def index(self, users):
+        rows = [(user.pk, user.name) for user in users]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk, _ in rows])
+            cursor.executemany(f'INSERT INTO {self.table} (rowid, name) VALUES (%s, %s)', rows)
+
+    def remove(self, user_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in user_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(f'INSERT INTO {self.table} (rowid, name) SELECT id, name FROM {User._meta.db_table}')
+
+
+class ILike(Lookup):
+    """
+    ``lhs ILIKE rhs``. Django's ``icontains`` compiles to
+    ``UPPER(lhs) LIKE UPPER(rhs)`` on PostgreSQL, which an index on the bare
+    column cannot serve.
+    """
+    lookup_name = 'ilike'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', (*lhs_params, *rhs_params)
+
+
+class PostgresTrigramSearchBackend(BaseSearchBackend):
+    """
+    Matches names with ``ILIKE``, which PostgreSQL answers from the
+    ``gin_trgm_ops`` index on ``name``; the index is maintained by the
+    database itself, so there is nothing to sync from signals.
+    """
+    index_name = 'users_user_name_trgm_idx'
+
+    def match(self, query):
+        return Q(ILike(F('name'), f'%{connection.ops.prep_for_like_query(query)}%'))
+
+    def rank(self, query):
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        return TrigramWordSimilarity(query, 'name')
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'REINDEX INDEX {self.index_name}')
+
+
+@lru_cache
+def _load_backend(path):
+    return import_string(path)()
+
+
+def get_search_backend():
+    path = getattr(settings, 'USER_SEARCH_BACKEND', None) or DEFAULT_BACKENDS.get(
+        connection.vendor, 'users.search.BaseSearchBackend'
+    )
+    return _load_backend(path)
+
+
+def search_users(query):
+    """Users whose email is exactly ``query``, or else whose name matches it, best match first."""
+    email = query.lower()
+    users = User.objects.alias(email_lower=Lower('email'))
+    backend = get_search_backend()
+
+    # An exact email match wins, otherwise search by name; both are
+    # decided in a single statement served by the lower(email) index.
+    return users.filter(
+        Q(email_lower=email) | (~Exists(users.filter(email_lower=email)) & backend.match(query))
+    ).annotate(
+        search_rank=Coalesce(backend.rank(query), 0.0)
+    ).order_by('-search_rank', 'id')
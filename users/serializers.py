@@ -1,6 +1,21 @@
+from functools import cache
+
+from django.conf import settings
 from django.contrib.auth import authenticate
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
-from .models import User, FriendRequest
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache import invalidate_friend_requests, is_user_active
+from .events import publish_friend_request_events
+from .graph import forget_suggestions
+from .models import User, FriendRequest, Friendship
+from .services import update_user_counters
+from .tokens import RevocableRefreshToken, is_revoked, revoke
 
 
 class SignupSerializer(serializers.ModelSerializer):
@@ -8,20 +23,25 @@ class SignupSerializer(serializers.ModelSerializer):
         model = User
         fields = ['email', 'password', 'name']
 
-    def create(self, validated_data):
-        user = User(
+    def build_user(self, validated_data):
+        return User(
             email=validated_data['email'].lower(),
             name=validated_data.get('name', '').lower()
         )
+
+    def create(self, validated_data):
+        user = self.build_user(validated_data)
         user.set_password(validated_data['password'])
         user.save()
         return user
 
 
-class LoginSerializer(serializers.Serializer):
+class CredentialsSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField(write_only=True)
 
+
+class LoginSerializer(CredentialsSerializer):
     def validate(self, data):
         email = data.get('email').lower()
         password = data.get('password')
@@ -34,28 +54,260 @@ class LoginSerializer(serializers.Serializer):
         return user
 
 
-class UserSerializer(serializers.ModelSerializer):
+class RefreshTokenSerializer(serializers.Serializer):
+    """
+    Issues a new access token, and with ``ROTATE_REFRESH_TOKENS`` a new
+    refresh token, revoking the one presented. Invalid, expired and revoked
+    tokens raise ``TokenError``.
+    """
+    refresh = serializers.CharField()
+
+    def validate(self, data):
+        refresh = RevocableRefreshToken(data['refresh'])
+        if not is_user_active(refresh[api_settings.USER_ID_CLAIM]):
+            raise TokenError(_("User is inactive"))
+
+        tokens = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            tokens['refresh'] = str(refresh)
+        return tokens
+
+
+class LogoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+    def save(self):
+        # Checked without the revocation store: logging out twice is not an error.
+        refresh = RefreshToken(self.validated_data['refresh'])
+        if is_revoked(refresh[api_settings.JTI_CLAIM]):
+            return
+        try:
+            revoke(refresh)
+        except TokenError:
+            pass
+
+
+class ValuesSerializerMixin:
+    """
+    For model serializers whose fields are plain columns: read the rows with
+    ``values()`` and build the same dicts ``.data`` would, without model
+    instances or per-field ``to_representation`` calls.
+    """
+
+    @classmethod
+    def values(cls, queryset, *extra_fields):
+        return queryset.values(*cls.Meta.fields, *extra_fields)
+
+    @classmethod
+    def from_values(cls, rows):
+        fields = cls.Meta.fields
+        return [{field: row[field] for field in fields} for row in rows]
+
+
+class EagerLoadingMixin:
+    """
+    Loads the relations a model serializer renders together with its rows.
+    Forward relations rendered by anything but their primary key are joined
+    with ``select_related``, many-valued ones are prefetched, and
+    ``Meta.select_related`` / ``Meta.prefetch_related`` add lookups the
+    fields do not reveal, such as relations read inside a method field.
+    """
+
+    @classmethod
+    def eager_load(cls, queryset):
+        select_related, prefetch_related = cls.eager_lookups()
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    @classmethod
+    @cache
+    def eager_lookups(cls):
+        select_related = list(getattr(cls.Meta, 'select_related', ()))
+        prefetch_related = list(getattr(cls.Meta, 'prefetch_related', ()))
+        for field in cls().fields.values():
+            if field.write_only or field.source == '*':
+                continue
+            lookup = field.source.replace('.', '__')
+            if isinstance(field, (serializers.ManyRelatedField, serializers.ListSerializer)):
+                prefetch_related.append(lookup)
+            elif isinstance(field, serializers.RelatedField) and not field.use_pk_only_optimization():
+                select_related.append(lookup)
+            elif isinstance(field, serializers.ModelSerializer):
+                select_related.append(lookup)
+                if isinstance(field, EagerLoadingMixin):
+                    nested_select, nested_prefetch = field.eager_lookups()
+                    select_related += [f'{lookup}__{nested}' for nested in nested_select]
+                    prefetch_related += [f'{lookup}__{nested}' for nested in nested_prefetch]
+        return tuple(select_related), tuple(prefetch_related)
+
+
+class UserSerializer(ValuesSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'name']
 
 
+class UserSummarySerializer(ValuesSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['friend_count', 'pending_request_count']
+
+
 class FriendRequestSerializer(serializers.ModelSerializer):
     class Meta:
         model = FriendRequest
         fields = ['id', 'sender', 'receiver', 'status', 'created_at']
+        read_only_fields = ['sender', 'status']
+        # Duplicates are rejected by the database constraints on insert, not by a lookup beforehand.
+        validators = []
 
     def validate(self, data):
-        if data['sender'] == data['receiver']:
+        user = self.context['request'].user
+        if data['receiver'] == user:
             raise serializers.ValidationError("You cannot send a friend request to yourself.")
-        if FriendRequest.objects.filter(sender=data['sender'], receiver=data['receiver']).exists():
-            raise serializers.ValidationError("A friend request has already been sent.")
+        # Not left to the pair constraint: the accepted request may have been archived.
+        if Friendship.objects.filter(user=user, friend=data['receiver']).exists():
+            raise serializers.ValidationError("You are already friends.")
         return data
 
 
-class PendingFriendRequestSerializer(serializers.ModelSerializer):
+class PendingFriendRequestSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     sender = serializers.SlugRelatedField(slug_field='email', queryset=User.objects.all())
 
     class Meta:
         model = FriendRequest
         fields = ['id', 'sender', 'created_at']
+
+
+class BulkFriendRequestSerializer(serializers.Serializer):
+    receivers = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=settings.FRIEND_REQUEST_BATCH_SIZE
+    )
+
+    def validate(self, data):
+        sender = self.context['request'].user
+        receivers = list(dict.fromkeys(data['receivers']))
+
+        # Set-based lookups validate the whole batch, in either direction of each pair.
+        users = set(User.objects.filter(id__in=receivers).values_list('id', flat=True))
+        friends = set(
+            Friendship.objects.filter(user=sender, friend_id__in=receivers).values_list('friend_id', flat=True)
+        )
+        existing = {}
+        for sender_id, receiver_id, request_status in FriendRequest.objects.filter(
+            Q(sender=sender, receiver_id__in=receivers) | Q(sender_id__in=receivers, receiver=sender)
+        ).values_list('sender_id', 'receiver_id', 'status'):
+            if sender_id == sender.id:
+                existing[receiver_id] = 'sent_by_sender'
+            elif request_status == 'sent':
+                existing[sender_id] = 'pending_reverse'
+            else:
+                existing[sender_id] = 'answered_reverse'
+
+        results = {}
+        for receiver in receivers:
+            if receiver == sender.id:
+                results[receiver] = {"receiver": receiver, "error": "You cannot send a friend request to yourself."}
+            elif receiver not in users:
+                results[receiver] = {"receiver": receiver, "error": "User not found."}
+            elif receiver in friends:
+                results[receiver] = {"receiver": receiver, "error": "You are already friends."}
+            elif existing.get(receiver) in ('sent_by_sender', 'answered_reverse'):
+                results[receiver] = {"receiver": receiver, "error": "A friend request has already been sent."}
+            else:
+                results[receiver] = existing.get(receiver)
+        return {'sender': sender, 'receivers': receivers, 'results': results}
+
+    def create(self, validated_data):
+        try:
+            return self._apply(validated_data)
+        except IntegrityError:
+            # A concurrent request claimed one of the pairs; re-check against the committed rows.
+            return self._apply(self.validate(validated_data))
+
+    def _apply(self, validated_data):
+        sender = validated_data['sender']
+        results = validated_data['results']
+        with transaction.atomic():
+            created = FriendRequest.objects.bulk_create([
+                FriendRequest(sender=sender, receiver_id=receiver)
+                for receiver, result in results.items() if result is None
+            ])
+            # The other side already asked: accept their request instead of creating a second one.
+            accepted = FriendRequest.objects.accept_pending(
+                sender.id, [receiver for receiver, result in results.items() if result == 'pending_reverse']
+            )
+            Friendship.objects.link_many([(request.sender_id, request.receiver_id) for request in accepted])
+            update_user_counters([(request, None) for request in created] + [(request, 'sent') for request in accepted])
+            forget_suggestions(created + accepted)
+            publish_friend_request_events(created + accepted)
+        invalidate_friend_requests(created + accepted)
+
+        for friend_request in created:
+            results[friend_request.receiver_id] = {
+                "receiver": friend_request.receiver_id, "id": friend_request.id, "status": friend_request.status
+            }
+        for friend_request in accepted:
+            results[friend_request.sender_id] = {
+                "receiver": friend_request.sender_id, "id": friend_request.id, "status": friend_request.status
+            }
+        for receiver, result in results.items():
+            if not isinstance(result, dict):
+                results[receiver] = {"receiver": receiver, "error": "A friend request has already been sent."}
+        return list(results.values())
+
+
+class FriendRequestActionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=['accept', 'reject'])
+
+
+class BulkRespondFriendRequestSerializer(serializers.Serializer):
+    requests = FriendRequestActionSerializer(many=True, allow_empty=False, max_length=settings.FRIEND_REQUEST_BATCH_SIZE)
+
+    def validate(self, data):
+        return {'actions': {item['id']: item['action'] for item in data['requests']}}
+
+    def create(self, validated_data):
+        actions = validated_data['actions']
+        receiver = self.context['request'].user
+
+        results, updated, changes, linked, unlinked = [], [], [], [], []
+        with transaction.atomic():
+            # Locked, so a concurrent answer to the same request applies after this one and counts once.
+            friend_requests = FriendRequest.objects.select_for_update().filter(
+                id__in=actions, receiver=receiver
+            ).in_bulk()
+            for request_id, action in actions.items():
+                friend_request = friend_requests.get(request_id)
+                if friend_request is None:
+                    results.append({"id": request_id, "error": "Friend request not found."})
+                    continue
+                previous_status = friend_request.status
+                friend_request.status = 'accepted' if action == 'accept' else 'rejected'
+                if friend_request.status != previous_status:
+                    pair = (friend_request.sender_id, friend_request.receiver_id)
+                    if friend_request.status == 'accepted':
+                        linked.append(pair)
+                    elif previous_status == 'accepted':
+                        unlinked.append(pair)
+                updated.append(friend_request)
+                changes.append((friend_request, previous_status))
+                results.append({"id": request_id, "status": friend_request.status})
+
+            FriendRequest.objects.bulk_update(updated, ['status'])
+            Friendship.objects.link_many(linked)
+            Friendship.objects.unlink_many(unlinked)
+            update_user_counters(changes)
+            forget_suggestions(updated)
+            publish_friend_request_events(updated)
+        invalidate_friend_requests(updated)
+        return results
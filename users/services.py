@@ -0,0 +1,123 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .cache import invalidate_friend_requests
+from .events import publish_friend_request_events
+from .graph import forget_suggestions
+from .models import FriendRequest, Friendship, User
+
+RESPONSE_STATUSES = {'accept': 'accepted', 'reject': 'rejected'}
+
+
+def update_user_counters(changes):
+    """
+    Apply friend request changes, ``[(friend_request, previous_status), ...]``
+    with ``previous_status`` ``None`` for a new request, to the users'
+    ``friend_count`` and ``pending_request_count``. Call it in the
+    transaction that makes the changes, so the counters commit with them.
+    """
+    friends = Counter()
+    pending = Counter()
+    for friend_request, previous_status in changes:
+        if friend_request.status == previous_status:
+            continue
+        for request_status, delta in ((previous_status, -1), (friend_request.status, 1)):
+            if request_status == 'sent':
+                pending[friend_request.receiver_id] += delta
+            elif request_status == 'accepted':
+                friends[friend_request.sender_id] += delta
+                friends[friend_request.receiver_id] += delta
+    User.objects.add_to_counters({'friend_count': friends, 'pending_request_count': pending})
+
+
+def count_subquery(queryset, field):
+    """Number of rows of ``queryset`` whose ``field`` is the outer user, for use in an UPDATE."""
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def reconcile_user_counters(user_ids, dry_run=False):
+    """
+    Recount ``friend_count`` and ``pending_request_count`` of ``user_ids``
+    from the friendships and pending requests and store the users whose
+    counters drifted, unless ``dry_run``. Returns those users as
+    ``[(user_id, (friend_count, pending_request_count), recounted), ...]``.
+    """
+    with transaction.atomic():
+        # The user rows are locked before counting: a change committing meanwhile is either counted
+        # here or applies its F() increment after this transaction, on top of the recount.
+        stored = {
+            user_id: (friend_count, pending_request_count)
+            for user_id, friend_count, pending_request_count in User.objects.select_for_update().filter(
+                id__in=user_ids
+            ).order_by('id').values_list('id', 'friend_count', 'pending_request_count')
+        }
+        friends = dict(Friendship.objects.filter(user_id__in=stored).order_by().values('user_id').annotate(
+            count=Count('id')
+        ).values_list('user_id', 'count'))
+        pending = dict(FriendRequest.objects.filter(receiver_id__in=stored, status='sent').order_by().values(
+            'receiver_id'
+        ).annotate(count=Count('id')).values_list('receiver_id', 'count'))
+
+        drifted = []
+        for user_id, counters in stored.items():
+            recounted = (friends.get(user_id, 0), pending.get(user_id, 0))
+            if counters != recounted:
+                drifted.append((user_id, counters, recounted))
+        if drifted and not dry_run:
+            # Recounted by the database in the same statement, which is far cheaper to build than a
+            # bulk_update CASE over thousands of users.
+            User.objects.filter(id__in=[user_id for user_id, _, _ in drifted]).update(
+                friend_count=count_subquery(Friendship.objects.all(), 'user'),
+                pending_request_count=count_subquery(FriendRequest.objects.filter(status='sent'), 'receiver'),
+            )
+    return drifted
+
+
+def send_friend_request(sender, receiver):
+    """
+    Insert a request from ``sender`` to ``receiver``, relying on the pair
+    constraints to reject duplicates. Returns ``(friend_request, outcome)``
+    where outcome is ``'sent'``, ``'accepted'`` when the receiver's own
+    pending request was accepted instead, or ``None`` on a duplicate.
+    """
+    try:
+        with transaction.atomic():
+            friend_request = FriendRequest.objects.create(sender=sender, receiver=receiver)
+            update_user_counters([(friend_request, None)])
+            return friend_request, 'sent'
+    except IntegrityError:
+        pass
+
+    with transaction.atomic():
+        accepted = FriendRequest.objects.accept_pending(sender.id, [receiver.id])
+        Friendship.objects.link_many([(request.sender_id, request.receiver_id) for request in accepted])
+        update_user_counters([(request, 'sent') for request in accepted])
+        forget_suggestions(accepted)
+        publish_friend_request_events(accepted)
+    if not accepted:
+        return None, None
+    invalidate_friend_requests(accepted)
+    return accepted[0], 'accepted'
+
+
+def respond_to_friend_request(friend_request, action):
+    # Keep the friendship edges and counters in step with the request they come from.
+    with transaction.atomic():
+        # Locked, so concurrent answers to the same request apply one after the other and count once.
+        previous_status = FriendRequest.objects.select_for_update().values_list('status', flat=True).get(
+            pk=friend_request.pk
+        )
+        friend_request.status = RESPONSE_STATUSES[action]
+        friend_request.save()
+        if friend_request.status != previous_status:
+            if friend_request.status == 'accepted':
+                Friendship.objects.link(friend_request.sender_id, friend_request.receiver_id)
+            elif previous_status == 'accepted':
+                Friendship.objects.unlink(friend_request.sender_id, friend_request.receiver_id)
+        update_user_counters([(friend_request, previous_status)])
+    return friend_request
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import invalidate_friend_requests, user_active_key, user_cache, user_payload_key
+from .events import publish_friend_request_events
+from .graph import forget_suggestions
+from .models import FriendRequest, Friendship
+from .search import get_search_backend
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, update_fields=None, **kwargs):
+    # Saves such as the last_login update on login do not touch the name.
+    if update_fields is not None and 'name' not in update_fields:
+        return
+    get_search_backend().index([instance])
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def release_user_counters(sender, instance, **kwargs):
+    # The cascade deletes the user's friendships and requests without going through the services.
+    User.objects.filter(id__in=Friendship.objects.filter(user=instance).values('friend_id')).update(
+        friend_count=F('friend_count') - 1
+    )
+    User.objects.filter(id__in=FriendRequest.objects.filter(sender=instance, status='sent').values('receiver_id')).update(
+        pending_request_count=F('pending_request_count') - 1
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_payload(sender, instance, **kwargs):
+    keys = [user_payload_key(instance.pk), user_active_key(instance.pk)]
+    transaction.on_commit(lambda: user_cache.invalidate(*keys))
+
+
+@receiver(post_save, sender=FriendRequest)
+@receiver(post_delete, sender=FriendRequest)
+def invalidate_friend_graph(sender, instance, **kwargs):
+    # Accepting or rejecting a request can change both sides' friend sets.
+    invalidate_friend_requests([instance])
+
+
+@receiver(post_save, sender=FriendRequest)
+def forget_friend_suggestion(sender, instance, **kwargs):
+    forget_suggestions([instance])
+
+
+@receiver(post_save, sender=FriendRequest)
+def publish_friend_request_event(sender, instance, **kwargs):
+    publish_friend_request_events([instance])
@@ -1,3 +1,1410 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Q
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import StatelessJWTAuthentication
+from .cache import REVOKED_TOKENS_RELOAD_LOCK_KEY, bump_graph_versions, get_friend_ids, get_pending_count, \
+    get_user_payloads, is_user_active, user_cache, user_payload_key
+from .conditional import list_reads
+from .events import event_stream, get_broker
+from .routers import ReplicaRouter, replica_reads
+from .search import PostgresTrigramSearchBackend, search_users
+from .throttles import FriendRequestThrottle
+from .tokens import is_revoked
+from .renderers import ORJSONRenderer
+from .metrics import QueryBudgetExceeded, measure_queries, registry, stop_measuring_queries
+from .hashers import TunableArgon2PasswordHasher, TunableScryptPasswordHasher, get_hashing_executor, \
+    run_in_hashing_pool
+from .models import ArchivedFriendRequest, FriendRequest, FriendSuggestion, Friendship, RevokedToken, User
+from .serializers import BulkFriendRequestSerializer, FriendRequestSerializer, UserSerializer
+from .services import reconcile_user_counters, respond_to_friend_request, send_friend_request
+from .utils import custom_response, get_tokens_for_user
+from .views import StreamingListMixin
+
+
+class PendingFriendRequestsQueryCountTests(TestCase):
+    def setUp(self):
+        # Both receivers start from a cold cache, whatever earlier tests left under the same user ids.
+        user_cache.local.clear()
+        user_cache.shared.clear()
+
+    def make_receiver(self, pending):
+        receiver = User.objects.create_user(email=f'receiver-{pending}@example.com', password='password')
+        senders = User.objects.bulk_create(
+            User(email=f'sender-{pending}-{i}@example.com') for i in range(pending)
+        )
+        FriendRequest.objects.bulk_create(FriendRequest(sender=sender, receiver=receiver) for sender in senders)
+        return receiver
+
+    def count_queries(self, path, receiver):
+        token = get_tokens_for_user(receiver)['access']
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']['data']['results']
+
+    def assert_constant_query_count(self, path):
+        few, rows = self.count_queries(path, self.make_receiver(1))
+        self.assertEqual(len(rows), 1)
+        many, rows = self.count_queries(path, self.make_receiver(8))
+        self.assertEqual(len(rows), 8)
+        self.assertTrue(all(row['sender'].startswith('sender-8-') for row in rows))
+        self.assertEqual(few, many)
+
+    def test_pending_list_query_count_does_not_grow_with_senders(self):
+        self.assert_constant_query_count(reverse('pending-friend-requests'))
+
+    def test_async_pending_list_query_count_does_not_grow_with_senders(self):
+        self.assert_constant_query_count(reverse('async-pending-friend-requests'))
+
+
+class RendererCompatibilityTests(TestCase):
+    """``ORJSONRenderer`` must render every envelope byte for byte as DRF's ``JSONRenderer`` does."""
+
+    def assert_same_bytes(self, data):
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_envelopes_render_like_json_renderer(self):
+        payloads = {
+            'non-ascii': {'name': 'Zoë Þórsdóttir 日本語 🙂', 'escapes': 'quote " backslash \\ tab \t nul \x00'},
+            'line separators': 'one\u2028two\u2029three',
+            'datetimes': {
+                'utc': datetime(2026, 10, 18, 12, 30, 5, 123456, tzinfo=dt_timezone.utc),
+                'offset': datetime(2026, 10, 18, 12, 30, tzinfo=dt_timezone(timedelta(hours=5, minutes=30))),
+                'naive': datetime(2026, 10, 18, 12, 30),
+                'date': date(2026, 10, 18),
+                'duration': timedelta(days=1, seconds=5),
+            },
+            'decimals': [Decimal('1.10'), Decimal('-0.000001'), Decimal('1E+3')],
+            'lazy': gettext_lazy('List of friends retrieved successfully.'),
+            'numbers': [0, -1, 2 ** 63 - 1, 2 ** 70, 1.5, 1e-7, 1e16, 0.1 + 0.2, True, False, None],
+            'exponent-like text': 'version 2e-5',
+            'nested': {'empty': {}, 'list': [[], [{}]], 1: 'int key'},
+        }
+        for name, data in payloads.items():
+            with self.subTest(name):
+                self.assert_same_bytes(custom_response(data=data, message="Done.").data)
+        self.assert_same_bytes(custom_response(
+            message="Invalid data.", status=400, errors={"receiver": ["Invalid pk \"0\" - object does not exist."]}
+        ).data)
+
+    def test_values_rows_render_like_serializer_data(self):
+        for name in ('Ann', 'Zoë', '日本 太郎', 'tab\tand\u2028separator'):
+            User.objects.create_user(email=f'{len(name)}-{ord(name[0])}@example.com', name=name, password='password')
+        users = User.objects.order_by('id')
+        rows = UserSerializer.from_values(UserSerializer.values(users))
+        self.assertEqual(
+            ORJSONRenderer().render(custom_response(data=rows).data),
+            JSONRenderer().render(custom_response(data=UserSerializer(users, many=True).data).data)
+        )
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    """One request per budgeted view on a cold cache; strict budgets make overruns raise."""
+
+    def setUp(self):
+        self.user, self.friend, self.other_friend, self.sender, self.stranger = [
+            User.objects.create_user(email=f'{name}@example.com', password='password', name=name)
+            for name in ('user', 'friend', 'other', 'sender', 'stranger')
+        ]
+        for friend in (self.friend, self.other_friend):
+            respond_to_friend_request(send_friend_request(self.user, friend)[0], 'accept')
+        respond_to_friend_request(send_friend_request(self.friend, self.stranger)[0], 'accept')
+        self.pending, _ = send_friend_request(self.sender, self.user)
+        FriendSuggestion.objects.create(user=self.user, suggested=self.stranger, mutual_friends=1)
+        self.tokens = get_tokens_for_user(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+        user_cache.local.clear()
+        user_cache.shared.clear()
+
+    def assert_within_budget(self, view, response):
+        self.assertLess(response.status_code, 400, response.content)
+        queries = int(re.search(r'desc="(\d+) queries"', response['Server-Timing']).group(1))
+        self.assertLessEqual(queries, settings.QUERY_BUDGETS[view])
+
+    def test_strict_budgets_raise(self):
+        registry.reset()
+        with override_settings(QUERY_BUDGETS={'UserSummaryView': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('user-summary'))
+            with override_settings(QUERY_BUDGET_STRICT=False):
+                self.assertEqual(self.client.get(reverse('user-summary')).status_code, 200)
+        self.assertEqual(registry._budget_exceeded, {'UserSummaryView': 2})
+
+    def test_every_budget_has_a_test(self):
+        for view in settings.QUERY_BUDGETS:
+            name = 'test_' + re.sub(r'(?<=[a-z])(?=[A-Z])', '_', view).lower().replace('.', '_')
+            self.assertTrue(hasattr(self, name), f'{view} has no budget test {name}')
+
+    def test_refresh_token_view(self):
+        response = self.client.post(reverse('token-refresh'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assert_within_budget('RefreshTokenView', response)
+
+    def test_logout_view(self):
+        response = self.client.post(reverse('logout'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assert_within_budget('LogoutView', response)
+
+    def test_user_search_view(self):
+        self.assert_within_budget('UserSearchView', self.client.get(reverse('user-search'), {'q': 'frien'}))
+
+    def test_friends_list_view(self):
+        self.assert_within_budget('FriendsListView', self.client.get(reverse('friends-list')))
+
+    def test_mutual_friends_view(self):
+        response = self.client.get(reverse('mutual-friends', args=[self.stranger.pk]))
+        self.assert_within_budget('MutualFriendsView', response)
+
+    def test_friend_suggestions_view(self):
+        self.assert_within_budget('FriendSuggestionsView', self.client.get(reverse('friend-suggestions')))
+
+    def test_pending_friend_requests_view(self):
+        response = self.client.get(reverse('pending-friend-requests'))
+        self.assert_within_budget('PendingFriendRequestsView', response)
+
+    def test_user_summary_view(self):
+        self.assert_within_budget('UserSummaryView', self.client.get(reverse('user-summary')))
+
+    def test_send_friend_request_view(self):
+        response = self.client.post(reverse('send-friend-request'), {'receiver': self.stranger.pk}, format='json')
+        self.assert_within_budget('SendFriendRequestView', response)
+
+    def test_send_friend_request_view_accepting_the_reverse_request(self):
+        response = self.client.post(reverse('send-friend-request'), {'receiver': self.sender.pk}, format='json')
+        self.assertEqual(response.json()['message'], "Friend request accepted successfully.")
+        self.assert_within_budget('SendFriendRequestView', response)
+
+    def test_respond_friend_request_view(self):
+        response = self.client.patch(
+            reverse('respond-friend-request', args=[self.pending.pk]), {'action': 'accept'}, format='json'
+        )
+        self.assert_within_budget('RespondFriendRequestView', response)
+
+    def test_async_views_refresh_token(self):
+        response = self.client.post(reverse('async-token-refresh'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assert_within_budget('async_views.refresh_token', response)
+
+    def test_async_views_logout(self):
+        response = self.client.post(reverse('async-logout'), {'refresh': self.tokens['refresh']}, format='json')
+        self.assert_within_budget('async_views.logout', response)
+
+    def test_async_views_search(self):
+        self.assert_within_budget('async_views.search', self.client.get(reverse('async-user-search'), {'q': 'frien'}))
+
+    def test_async_views_friends(self):
+        self.assert_within_budget('async_views.friends', self.client.get(reverse('async-friends-list')))
+
+    def test_async_views_pending_friend_requests(self):
+        response = self.client.get(reverse('async-pending-friend-requests'))
+        self.assert_within_budget('async_views.pending_friend_requests', response)
+
+    def test_async_views_summary(self):
+        self.assert_within_budget('async_views.summary', self.client.get(reverse('async-user-summary')))
+
+
+class ConditionalListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+
+    def test_unchanged_list_is_not_modified(self):
+        for name in ('friends-list', 'pending-friend-requests', 'async-friends-list', 'async-pending-friend-requests'):
+            with self.subTest(name):
+                response = self.client.get(reverse(name))
+                self.assertNotIn('Last-Modified', response)
+                self.assertEqual(self.client.get(reverse(name), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+                bump_graph_versions([self.user.pk])
+                self.assertEqual(self.client.get(reverse(name), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    @override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=5)
+    def test_recently_changed_list_is_read_from_the_primary(self):
+        router = ReplicaRouter()
+        now = time.time_ns()
+        with replica_reads():
+            with list_reads(now - 1_000_000_000):
+                self.assertEqual(router.db_for_read(User), 'default')
+            with list_reads(now - 10_000_000_000):
+                self.assertEqual(router.db_for_read(User), 'replica')
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        user_cache.local.clear()
+        user_cache.shared.clear()
+        user_cache.reset_stats()
+        self.user = User.objects.create_user(email='user@example.com', name='user', password='password')
+        self.friend = User.objects.create_user(email='friend@example.com', name='friend', password='password')
+        Friendship.objects.bulk_create([
+            Friendship(user=self.user, friend=self.friend), Friendship(user=self.friend, friend=self.user)
+        ])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+
+    def friend_names(self):
+        response = self.client.get(reverse('friends-list'))
+        self.assertEqual(response.status_code, 200)
+        return [row['name'] for row in response.json()['results']['data']['results']]
+
+    def test_renaming_a_user_refreshes_cached_friend_lists_after_commit(self):
+        self.assertEqual(self.friend_names(), ['friend'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.friend.name = 'renamed'
+            self.friend.save()
+            # Until the rename commits, other transactions still read the old row, and so does the cache.
+            self.assertEqual(self.friend_names(), ['friend'])
+            self.assertEqual(user_cache.shared.get(user_payload_key(self.friend.pk))['name'], 'friend')
+        self.assertIsNone(user_cache.shared.get(user_payload_key(self.friend.pk)))
+        self.assertEqual(self.friend_names(), ['renamed'])
+
+    def test_stats_count_each_tier(self):
+        unknown = self.friend.pk + 1000
+        get_user_payloads([self.user.pk, self.friend.pk])
+        self.assertEqual(user_cache.stats(), {'local_hits': 0, 'shared_hits': 0, 'misses': 2, 'invalidations': 0})
+
+        get_user_payloads([self.user.pk, self.friend.pk])
+        self.assertEqual(user_cache.stats(), {'local_hits': 2, 'shared_hits': 0, 'misses': 2, 'invalidations': 0})
+
+        # Another process: its own local tier is cold, the shared one is not.
+        user_cache.local.clear()
+        get_user_payloads([self.friend.pk])
+        self.assertEqual(user_cache.stats(), {'local_hits': 2, 'shared_hits': 1, 'misses': 2, 'invalidations': 0})
+
+        # Unknown ids are never cached, so they miss every time.
+        get_user_payloads([self.friend.pk, unknown])
+        get_user_payloads([unknown])
+        self.assertEqual(user_cache.stats(), {'local_hits': 3, 'shared_hits': 1, 'misses': 4, 'invalidations': 0})
+
+        user_cache.invalidate(user_payload_key(self.friend.pk))
+        self.assertEqual(user_cache.stats(), {'local_hits': 3, 'shared_hits': 1, 'misses': 4, 'invalidations': 1})
+
+        staff = User.objects.create_user(email='staff@example.com', password='password', is_staff=True)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(staff)['access']}")
+        stats = user_cache.stats()
+        self.assertEqual(client.get(reverse('cache-stats')).json()['results']['data'], stats)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    The test "replica" mirrors the primary, so both aliases see the same rows
+    and only the connection a query ran on shows where the router sent it.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        user_cache.local.clear()
+        user_cache.shared.clear()
+        self.user = User.objects.create_user(email='user@example.com', name='user', password='password')
+        self.friend = User.objects.create_user(email='friend@example.com', name='friend', password='password')
+        self.sender = User.objects.create_user(email='sender@example.com', name='sender', password='password')
+        Friendship.objects.bulk_create([
+            Friendship(user=self.user, friend=self.friend), Friendship(user=self.friend, friend=self.user)
+        ])
+        FriendRequest.objects.create(sender=self.sender, receiver=self.user)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(user)['access']}")
+        return client
+
+    def request(self, client, method, path, data=None):
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(client, method)(path, data, format='json')
+        return response, len(primary), len(replica)
+
+    def test_read_views_read_from_the_replica(self):
+        client = self.client_for(self.user)
+        for path in (reverse('user-search') + '?q=friend', reverse('friends-list'),
+                     reverse('pending-friend-requests')):
+            with self.subTest(path):
+                # Warm the cache first: its loaders read from the primary on purpose.
+                client.get(path)
+                # Past the sticky window of the graph version the lists were built from.
+                with override_settings(REPLICA_STICKY_SECONDS=0):
+                    response, primary, replica = self.request(client, 'get', path)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(primary, 0)
+                self.assertGreater(replica, 0)
+
+    def test_streamed_lists_read_from_the_replica(self):
+        client = self.client_for(self.user)
+        for name in ('friends-list', 'pending-friend-requests'):
+            for stream in ('json', 'ndjson'):
+                with self.subTest(name=name, stream=stream):
+                    b''.join(client.get(reverse(name), {'stream': stream}).streaming_content)
+                    # The rows are read while the body is written, after the view has returned.
+                    with override_settings(REPLICA_STICKY_SECONDS=0), \
+                            CaptureQueriesContext(connections['default']) as primary, \
+                            CaptureQueriesContext(connections['replica']) as replica:
+                        response = client.get(reverse(name), {'stream': stream})
+                        streamed = len(primary), len(replica)
+                        b''.join(response.streaming_content)
+                    self.assertEqual(len(primary), 0)
+                    self.assertGreater(len(replica), streamed[1])
+
+    def test_writer_is_pinned_to_the_primary(self):
+        stranger = User.objects.create_user(email='stranger@example.com', name='stranger', password='password')
+        client = self.client_for(self.user)
+        path = reverse('user-search') + '?q=stranger'
+        client.get(path)
+
+        response, _, _ = self.request(client, 'post', reverse('send-friend-request'), {'receiver': stranger.pk})
+        self.assertEqual(response.status_code, 201)
+
+        response, primary, replica = self.request(client, 'get', path)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        # Only the writer is pinned; everyone else keeps reading from the replica.
+        other = self.client_for(self.friend)
+        other.get(path)
+        _, primary, replica = self.request(other, 'get', path)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_cache_loaders_read_from_the_primary(self):
+        loaders = {
+            'friend ids': lambda: get_friend_ids(self.user.pk),
+            'pending count': lambda: get_pending_count(self.user.pk),
+            'user payloads': lambda: get_user_payloads([self.friend.pk]),
+            'active user': lambda: is_user_active(self.user.pk),
+        }
+        for name, loader in loaders.items():
+            with self.subTest(name):
+                user_cache.local.clear()
+                user_cache.shared.clear()
+                with replica_reads(), CaptureQueriesContext(connections['default']) as primary, \
+                        CaptureQueriesContext(connections['replica']) as replica:
+                    loader()
+                self.assertGreater(len(primary), 0)
+                self.assertEqual(len(replica), 0)
+
+
+class FriendSuggestionsTests(TestCase):
+    def setUp(self):
+        user_cache.local.clear()
+        user_cache.shared.clear()
+        self.user, self.first, self.second, self.third, self.fourth = (
+            User.objects.create_user(email=f'{name}@example.com', password='password')
+            for name in ('user', 'first', 'second', 'third', 'fourth')
+        )
+        Friendship.objects.link_many([
+            (self.user.pk, self.first.pk), (self.user.pk, self.second.pk),
+            (self.first.pk, self.third.pk), (self.second.pk, self.fourth.pk),
+        ])
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+
+    def suggested(self):
+        response = self.client.get(reverse('friend-suggestions'))
+        self.assertEqual(response.status_code, 200)
+        return [row['email'] for row in response.json()['results']['data']]
+
+    def test_suggestions_are_worked_out_until_computed(self):
+        self.assertEqual(self.suggested(), ['third@example.com', 'fourth@example.com'])
+
+        call_command('compute_friend_suggestions', user=[self.user.pk], stdout=StringIO())
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.suggestions_computed_at)
+        self.assertEqual(self.suggested(), ['third@example.com', 'fourth@example.com'])
+
+    def test_computed_empty_suggestions_stay_empty(self):
+        User.objects.filter(pk=self.user.pk).update(suggestions_computed_at=timezone.now())
+        self.assertEqual(self.suggested(), [])
+
+    @override_settings(FRIEND_SUGGESTION_LIVE_MAX_FRIENDS=1)
+    def test_live_suggestions_follow_a_capped_number_of_friends(self):
+        self.assertEqual(self.suggested(), ['third@example.com'])
+
+
+class MetricsAccessTests(TestCase):
+    def get(self, token=None):
+        client = APIClient()
+        if token:
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client.get(reverse('metrics'))
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_are_for_staff_without_a_token(self):
+        user = User.objects.create_user(email='user@example.com', password='password')
+        staff = User.objects.create_user(email='staff@example.com', password='password', is_staff=True)
+        self.assertEqual(self.get().status_code, 401)
+        self.assertEqual(self.get(get_tokens_for_user(user)['access']).status_code, 403)
+        response = self.get(get_tokens_for_user(staff)['access'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+
+    @override_settings(METRICS_TOKEN='metrics-token')
+    def test_metrics_token_is_required_when_set(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get('wrong-token').status_code, 403)
+        self.assertEqual(self.get('metrics-token').status_code, 200)
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN the query behind each endpoint and fail on any that reads a whole table."""
+    # Plan lines that read a whole table instead of seeking into an index.
+    full_scan = {
+        'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW)(\w+)\b(?! VIRTUAL TABLE)'),
+        'postgresql': re.compile(r'\bSeq Scan on (\w+)'),
+    }
+
+    def setUp(self):
+        users = User.objects.bulk_create(
+            User(email=f'user-{i}@example.com', name=f'user {i}') for i in range(200)
+        )
+        FriendRequest.objects.bulk_create(
+            FriendRequest(sender=sender, receiver=receiver, status=('sent', 'accepted', 'rejected')[i % 3])
+            for i, (sender, receiver) in enumerate(zip(users, users[1:] + users[:1]))
+        )
+        Friendship.objects.link_many([(users[i].pk, users[i + 2].pk) for i in range(0, 198, 3)])
+        self.user_id, *self.other_ids = [user.pk for user in users[:3]]
+        with connection.cursor() as cursor:
+            # Statistics let SQLite weigh the partial pending index against the receiver foreign key index.
+            cursor.execute('ANALYZE')
+            if connection.vendor == 'postgresql':
+                # Small test tables are cheaper to scan; ask whether an index is usable at all.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def endpoint_queries(self):
+        user_id, other_ids = self.user_id, self.other_ids
+        pending = FriendRequest.objects.filter(receiver_id=user_id, status='sent')
+        return {
+            'UserSearchView': search_users('alice'),
+            'UserSearchView (email)': search_users('alice@example.com'),
+            'FriendsListView': Friendship.objects.filter(user_id=user_id).order_by('friend_id').values('friend_id'),
+            'FriendsListView (payloads)': User.objects.filter(id__in=other_ids),
+            'PendingFriendRequestsView': pending.order_by('-id')[:51],
+            'PendingFriendRequestsView (count)': pending,
+            'SendFriendRequestView (accept reverse)': FriendRequest.objects.filter(
+                receiver_id=user_id, sender_id__in=other_ids[:1], status='sent'
+            ),
+            'RespondFriendRequestView': FriendRequest.objects.filter(pk=user_id),
+            'BulkSendFriendRequestView': FriendRequest.objects.filter(
+                Q(sender_id=user_id, receiver_id__in=other_ids) | Q(sender_id__in=other_ids, receiver_id=user_id)
+            ),
+            'BulkRespondFriendRequestView': FriendRequest.objects.filter(id__in=other_ids, receiver_id=user_id),
+        }
+
+    @skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Plans are only read on SQLite and PostgreSQL')
+    def test_endpoint_queries_use_indexes(self):
+        pattern = self.full_scan[connection.vendor]
+        for name, queryset in self.endpoint_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(pattern.findall(plan), [], plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_pending_list_uses_the_partial_index(self):
+        plan = FriendRequest.objects.filter(receiver_id=self.user_id, status='sent').order_by('-id')[:51].explain()
+        self.assertIn('users_fr_pending_receiver_idx', plan)
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {'friend_request': '3/minute', 'bulk_friend_request': '10/hour'},
+})
+class SlidingWindowThrottleTests(TestCase):
+    # The start of the current one minute window; the local memory cache expires keys by the same clock.
+    start = int(time.time()) // 60 * 60
+
+    def setUp(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+        self.request = mock.Mock(user=mock.Mock(pk=1, is_authenticated=True))
+
+    def allowed(self, at, throttle=None):
+        with mock.patch('users.throttles.time.time', return_value=self.start + at):
+            return (throttle or FriendRequestThrottle()).allow_request(self.request, None)
+
+    def test_limit_holds_within_a_window(self):
+        self.assertEqual([self.allowed(at) for at in (0, 10, 20, 30)], [True, True, True, False])
+
+    def test_previous_window_is_weighted_by_its_overlap(self):
+        for at in (0, 10, 20):
+            self.assertTrue(self.allowed(at))
+        # Half way into the next window the previous one weighs 1.5 requests.
+        self.assertTrue(self.allowed(90))
+        self.assertFalse(self.allowed(91))
+        # Three quarters in, 0.75 of it is left.
+        self.assertTrue(self.allowed(105))
+        self.assertFalse(self.allowed(106))
+        # With a window in between, the first one no longer counts.
+        self.assertEqual([self.allowed(at) for at in (180, 181, 182, 183)], [True, True, True, False])
+
+    def test_wait_is_the_time_until_a_request_fits(self):
+        for at in (0, 10, 20):
+            self.allowed(at)
+        throttle = FriendRequestThrottle()
+        self.assertFalse(self.allowed(30, throttle))
+        # At 80s the previous window's three requests weigh 2, leaving room for one.
+        self.assertAlmostEqual(throttle.wait(), 50)
+        self.assertFalse(self.allowed(79.9))
+        self.assertTrue(self.allowed(80))
+
+    def test_rejected_requests_are_given_back(self):
+        for at in (0, 10, 20, 30, 40):
+            self.allowed(at)
+        self.assertEqual(caches['default'].get(f'throttle:friend_request:1:{self.start // 60}'), 3)
+
+    def test_concurrent_requests_share_the_limit(self):
+        results = []
+        barrier = threading.Barrier(20)
+
+        def request():
+            throttle = FriendRequestThrottle()
+            barrier.wait()
+            results.append(throttle.allow_request(self.request, None))
+
+        with mock.patch('users.throttles.time.time', return_value=self.start):
+            threads = [threading.Thread(target=request) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results.count(True), 3)
+
+    def test_fourth_send_within_a_minute_is_throttled(self):
+        sender = User.objects.create_user(email='sender@example.com', password='password')
+        receivers = User.objects.bulk_create(User(email=f'receiver-{i}@example.com') for i in range(4))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(sender)['access']}")
+        statuses = [
+            client.post(reverse('send-friend-request'), {'receiver': receiver.pk}, format='json').status_code
+            for receiver in receivers
+        ]
+        self.assertEqual(statuses, [201, 201, 201, 429])
+
+
+class SendFriendRequestTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.sender = User.objects.create_user(email='sender@example.com', password='password')
+        self.receiver = User.objects.create_user(email='receiver@example.com', password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.sender)['access']}")
+
+    def send(self):
+        return self.client.post(reverse('send-friend-request'), {'receiver': self.receiver.pk}, format='json')
+
+    def concurrent_send(self, sender, receiver):
+        # Measured on its own, like the separate request it stands for.
+        _, token = measure_queries()
+        try:
+            send_friend_request(sender, receiver)
+        finally:
+            stop_measuring_queries(token)
+
+    def assert_rejected(self, response):
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['message'],
+                         {'non_field_errors': ['A friend request has already been sent.']})
+
+    def test_duplicate_send_is_rejected(self):
+        self.assertEqual(self.send().status_code, 201)
+        self.assert_rejected(self.send())
+        self.assertEqual(FriendRequest.objects.count(), 1)
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.pending_request_count, 1)
+
+    def test_request_inserted_after_validation_is_a_duplicate(self):
+        validate = FriendRequestSerializer.validate
+
+        def racing_validate(serializer, data):
+            # Another request from the same sender commits between validation and the insert.
+            data = validate(serializer, data)
+            self.concurrent_send(self.sender, self.receiver)
+            return data
+
+        with mock.patch.object(FriendRequestSerializer, 'validate', racing_validate):
+            self.assert_rejected(self.send())
+        self.assertEqual(FriendRequest.objects.count(), 1)
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.pending_request_count, 1)
+
+    def test_reverse_request_inserted_after_validation_is_accepted(self):
+        validate = FriendRequestSerializer.validate
+
+        def racing_validate(serializer, data):
+            data = validate(serializer, data)
+            self.concurrent_send(self.receiver, self.sender)
+            return data
+
+        with mock.patch.object(FriendRequestSerializer, 'validate', racing_validate):
+            response = self.send()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(FriendRequest.objects.values_list('sender', 'receiver', 'status')),
+                         [(self.receiver.pk, self.sender.pk, 'accepted')])
+        self.assertTrue(Friendship.objects.filter(user=self.sender, friend=self.receiver).exists())
+
+    def test_failed_insert_is_not_a_server_error(self):
+        with mock.patch.object(FriendRequest.objects, 'create', side_effect=IntegrityError):
+            self.assert_rejected(self.send())
+        self.assertFalse(FriendRequest.objects.exists())
+        self.receiver.refresh_from_db()
+        self.assertEqual(self.receiver.pending_request_count, 0)
+
+
+class BulkSendThrottleTests(TestCase):
+    def setUp(self):
+        self.addCleanup(user_cache.shared.clear)
+        self.user = User.objects.create_user(email='user@example.com', password='password')
+        self.receivers = User.objects.bulk_create(User(email=f'receiver-{i}@example.com') for i in range(20))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+
+    def send(self, receivers):
+        return self.client.post(
+            reverse('bulk-send-friend-request'), {'receivers': [user.pk for user in receivers]}, format='json'
+        )
+
+    @override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {'friend_request': '3/minute', 'bulk_friend_request': '15/hour'},
+    })
+    def test_batches_have_their_own_rate(self):
+        response = self.send(self.receivers[:10])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['status'] for row in response.json()['results']['data']], ['sent'] * 10)
+
+        self.assertEqual(self.send(self.receivers[10:20]).status_code, 429)
+        # The batch counted as one single send, and the rejected one not at all.
+        for receiver in self.receivers[10:12]:
+            response = self.client.post(reverse('send-friend-request'), {'receiver': receiver.pk}, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.send(self.receivers[12:13]).status_code, 429)
+
+    @override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {'friend_request': '3/minute', 'bulk_friend_request': '1000/hour'},
+    })
+    def test_batches_of_one_are_held_to_the_single_rate(self):
+        for receiver in self.receivers[:3]:
+            self.assertEqual(self.send([receiver]).status_code, 200)
+        self.assertEqual(self.send([self.receivers[3]]).status_code, 429)
+        response = self.client.post(reverse('send-friend-request'), {'receiver': self.receivers[3].pk}, format='json')
+        self.assertEqual(response.status_code, 429)
+
+
+class BulkFriendRequestTests(TestCase):
+    def setUp(self):
+        user_cache.local.clear()
+        user_cache.shared.clear()
+        self.addCleanup(user_cache.shared.clear)
+        self.user, self.new, self.requested, self.asking, self.friend, self.rejecter = (
+            User.objects.create_user(email=f'{name}@example.com', password='password')
+            for name in ('user', 'new', 'requested', 'asking', 'friend', 'rejecter')
+        )
+        send_friend_request(self.user, self.requested)
+        send_friend_request(self.asking, self.user)
+        respond_to_friend_request(send_friend_request(self.user, self.friend)[0], 'accept')
+        respond_to_friend_request(send_friend_request(self.rejecter, self.user)[0], 'reject')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+
+    def post(self, name, data):
+        response = self.client.post(reverse(name), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']['data']
+
+    def assert_counters_consistent(self):
+        self.assertEqual(reconcile_user_counters(User.objects.values_list('id', flat=True)), [])
+
+    def test_send_reports_each_receiver(self):
+        unknown = User.objects.order_by('-id').first().pk + 1
+        receivers = [self.new.pk, self.user.pk, unknown, self.requested.pk, self.asking.pk, self.friend.pk,
+                     self.rejecter.pk, self.new.pk]
+        results = self.post('bulk-send-friend-request', {'receivers': receivers})
+
+        asking_request = FriendRequest.objects.get(sender=self.asking)
+        new_request = FriendRequest.objects.get(sender=self.user, receiver=self.new)
+        self.assertEqual(results, [
+            {'receiver': self.new.pk, 'id': new_request.pk, 'status': 'sent'},
+            {'receiver': self.user.pk, 'error': "You cannot send a friend request to yourself."},
+            {'receiver': unknown, 'error': "User not found."},
+            {'receiver': self.requested.pk, 'error': "A friend request has already been sent."},
+            {'receiver': self.asking.pk, 'id': asking_request.pk, 'status': 'accepted'},
+            {'receiver': self.friend.pk, 'error': "You are already friends."},
+            {'receiver': self.rejecter.pk, 'error': "A friend request has already been sent."},
+        ])
+        self.assertTrue(Friendship.objects.filter(user=self.user, friend=self.asking).exists())
+        self.assert_counters_consistent()
+
+    def test_send_retries_after_a_concurrent_insert(self):
+        serializer = BulkFriendRequestSerializer(
+            data={'receivers': [self.new.pk, self.rejecter.pk]}, context={'request': mock.Mock(user=self.user)}
+        )
+        self.assertTrue(serializer.is_valid())
+        # Lands between validation and the insert, so the batch's first attempt hits the pair constraint.
+        send_friend_request(self.new, self.user)
+
+        with mock.patch.object(BulkFriendRequestSerializer, '_apply', autospec=True,
+                               side_effect=BulkFriendRequestSerializer._apply) as apply:
+            results = serializer.save()
+        self.assertEqual(apply.call_count, 2)
+        new_request = FriendRequest.objects.get(sender=self.new, receiver=self.user)
+        self.assertEqual(results, [
+            {'receiver': self.new.pk, 'id': new_request.pk, 'status': 'accepted'},
+            {'receiver': self.rejecter.pk, 'error': "A friend request has already been sent."},
+        ])
+        self.assertEqual(FriendRequest.objects.filter(sender__in=[self.user, self.new],
+                                                      receiver__in=[self.user, self.new]).count(), 1)
+        self.assert_counters_consistent()
+
+    def test_respond_links_and_unlinks_friends(self):
+        rejected = FriendRequest.objects.get(sender=self.rejecter)
+        results = self.post('bulk-respond-friend-request', {'requests': [
+            {'id': FriendRequest.objects.get(sender=self.asking).pk, 'action': 'accept'},
+            {'id': rejected.pk, 'action': 'accept'},
+            {'id': FriendRequest.objects.get(receiver=self.requested).pk, 'action': 'accept'},
+        ]})
+
+        self.assertEqual([result.get('status', result.get('error')) for result in results],
+                         ['accepted', 'accepted', "Friend request not found."])
+        self.assertEqual(
+            set(Friendship.objects.filter(user=self.user).values_list('friend__email', flat=True)),
+            {'asking@example.com', 'rejecter@example.com', 'friend@example.com'}
+        )
+        self.assert_counters_consistent()
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.friend_count, self.user.pending_request_count), (3, 0))
+
+        # Taking an acceptance back removes the friendship, as respond_to_friend_request does.
+        self.post('bulk-respond-friend-request', {'requests': [{'id': rejected.pk, 'action': 'reject'}]})
+        self.assertFalse(Friendship.objects.filter(user=self.rejecter).exists())
+        self.assert_counters_consistent()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.friend_count, 2)
+
+    def test_writes_are_one_transaction(self):
+        cases = [
+            ('bulk-send-friend-request', {'receivers': [self.new.pk, self.asking.pk]}),
+            ('bulk-respond-friend-request', {'requests': [
+                {'id': FriendRequest.objects.get(sender=self.asking).pk, 'action': 'accept'},
+            ]}),
+        ]
+        for name, data in cases:
+            with self.subTest(name):
+                before = sorted(FriendRequest.objects.values_list('id', 'status'))
+                with mock.patch('users.serializers.update_user_counters', side_effect=RuntimeError), \
+                        self.assertRaises(RuntimeError):
+                    self.client.post(reverse(name), data, format='json')
+                self.assertEqual(sorted(FriendRequest.objects.values_list('id', 'status')), before)
+                self.assertFalse(Friendship.objects.filter(user=self.user, friend=self.asking).exists())
+
+
+class DatabaseSettingsTests(TransactionTestCase):
+    """
+    The configured database under concurrent writers. SQLite tests run in
+    memory, where WAL does not apply, so its settings are tried on a file.
+    """
+    writers = 8
+    alias = 'settings-check'
+
+    def setUp(self):
+        settings_dict = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            directory = tempfile.TemporaryDirectory()
+            self.addCleanup(directory.cleanup)
+            settings_dict = {**settings_dict, 'NAME': os.path.join(directory.name, 'db.sqlite3')}
+        elif 'pool' in settings_dict['OPTIONS']:
+            # Plain connections per thread; a pool each would outlive the test.
+            settings_dict = {**settings_dict, 'OPTIONS': {
+                key: value for key, value in settings_dict['OPTIONS'].items() if key != 'pool'
+            }}
+        self.settings_dict = settings_dict
+        self.run_sql(
+            'CREATE TABLE users_settings_check (n integer NOT NULL)', 'INSERT INTO users_settings_check VALUES (0)'
+        )
+        self.addCleanup(self.run_sql, 'DROP TABLE users_settings_check')
+
+    def connect(self):
+        # A connection of this thread's own, made from the configured settings.
+        connections[self.alias] = connections['default'].__class__(self.settings_dict, self.alias)
+        return connections[self.alias]
+
+    def run_sql(self, *statements):
+        database = self.connect()
+        try:
+            with database.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+                return cursor.fetchall() if cursor.description else None
+        finally:
+            database.close()
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_uses_wal(self):
+        self.assertEqual(self.run_sql('PRAGMA journal_mode'), [('wal',)])
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    def test_postgresql_pool_matches_the_settings(self):
+        pool_options = connection.settings_dict['OPTIONS'].get('pool')
+        if settings.DB_POOL:
+            connection.ensure_connection()
+            self.assertEqual((connection.pool.min_size, connection.pool.max_size),
+                             (pool_options['min_size'], pool_options['max_size']))
+        else:
+            self.assertIsNone(pool_options)
+
+    def test_concurrent_writers_do_not_fail(self):
+        errors = []
+        barrier = threading.Barrier(self.writers)
+
+        def write():
+            database = self.connect()
+            try:
+                barrier.wait()
+                # Read before writing: a deferred SQLite transaction fails to upgrade its lock here.
+                with transaction.atomic(using=self.alias), database.cursor() as cursor:
+                    cursor.execute('SELECT n FROM users_settings_check')
+                    cursor.fetchall()
+                    time.sleep(0.01)
+                    cursor.execute('UPDATE users_settings_check SET n = n + 1')
+            except Exception as error:
+                errors.append(error)
+            finally:
+                database.close()
+
+        threads = [threading.Thread(target=write) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.run_sql('SELECT n FROM users_settings_check'), [(self.writers,)])
+
+
+class PostgresNameSearchTests(TestCase):
+    def search_sql(self, connection):
+        with mock.patch('users.search.get_search_backend', return_value=PostgresTrigramSearchBackend()):
+            return str(search_users('ali_ce').query.get_compiler(connection=connection).as_sql())
+
+    def test_name_match_is_ilike_on_the_indexed_column(self):
+        # Compiled for PostgreSQL without connecting, so it runs on every engine.
+        postgres = PostgresDatabaseWrapper({**connections['default'].settings_dict, 'OPTIONS': {}}, 'postgres')
+        sql = self.search_sql(postgres)
+        self.assertIn('"users_user"."name" ILIKE %s', sql)
+        self.assertNotIn('UPPER', sql)
+        self.assertIn("'%ali\\\\_ce%'", sql)
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+    def test_name_search_uses_the_trigram_index(self):
+        with connection.cursor() as cursor:
+            # Tiny test tables are cheaper to scan; ask whether the index is usable at all.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = search_users('alice').explain()
+        self.assertIn(PostgresTrigramSearchBackend.index_name, plan)
+        self.assertNotIn('Seq Scan on users_user', plan)
+
+
+class SearchCursorPaginationTests(TestCase):
+    def setUp(self):
+        # Equal names rank equal, so pages break inside runs of tied ranks.
+        for i in range(12):
+            User.objects.create_user(email=f'tied-{i}@example.com', name='alice', password='password')
+        for i in range(9):
+            User.objects.create_user(email=f'other-{i}@example.com', name=f'alice number {i}', password='password')
+        self.expected = list(search_users('alice').values_list('id', flat=True))
+        self.assertEqual(len(self.expected), 21)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(User.objects.first())['access']}")
+
+    def walk(self, url, link='next'):
+        ids = []
+        while url:
+            page = self.client.get(url).json()['results']['data']
+            ids.extend(row['id'] for row in (page['results'] if link == 'next' else reversed(page['results'])))
+            url = page[link]
+        return ids
+
+    def test_cursor_pages_cover_tied_ranks_once(self):
+        self.assertEqual(self.walk(reverse('user-search') + '?q=alice&pagination=cursor'), self.expected)
+
+        last_page = self.client.get(reverse('user-search') + '?q=alice&pagination=cursor').json()
+        while last_page['results']['data']['next']:
+            last_page = self.client.get(last_page['results']['data']['next']).json()
+        self.assertEqual(self.walk(last_page['results']['data']['previous'], link='previous'), self.expected[:20][::-1])
+
+    def test_async_cursor_pages_cover_tied_ranks_once(self):
+        self.assertEqual(self.walk(reverse('async-user-search') + '?q=alice&pagination=cursor'), self.expected)
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('user-search'), {'q': 'alice', 'cursor': 'cD14LDE='})
+        self.assertEqual(response.status_code, 404)
+
+
+class StreamingListTests(TestCase):
+    def setUp(self):
+        user_cache.local.clear()
+        user_cache.shared.clear()
+        registry.reset()
+        self.user = User.objects.create_user(email='user@example.com', name='user', password='password')
+        for i in range(7):
+            friend = User.objects.create_user(email=f'friend-{i}@example.com', name=f'friend {i}', password='password')
+            Friendship.objects.bulk_create([Friendship(user=self.user, friend=friend),
+                                            Friendship(user=friend, friend=self.user)])
+        for i in range(5):
+            sender = User.objects.create_user(email=f'sender-{i}@example.com', name=f'sender {i}', password='password')
+            send_friend_request(sender, self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+        # Smaller than either list, so the stream spans several chunks.
+        patcher = mock.patch.object(StreamingListMixin, 'stream_chunk_size', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def walk(self, path):
+        rows, url = [], f'{path}?page_size=2'
+        while url:
+            response = self.client.get(url).json()
+            rows.extend(response['results']['data']['results'])
+            url = response['results']['data']['next']
+        return response, rows
+
+    def stream(self, path, stream):
+        response = self.client.get(path, {'stream': stream})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson_writes_one_row_per_line_in_cursor_order(self):
+        for name in ('friends-list', 'pending-friend-requests'):
+            with self.subTest(name):
+                _, rows = self.walk(reverse(name))
+                response, content = self.stream(reverse(name), 'ndjson')
+                self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+                self.assertTrue(content.endswith(b'\n'))
+                lines = content.split(b'\n')[:-1]
+                self.assertNotIn(b'', lines)
+                self.assertEqual([json.loads(line) for line in lines], rows)
+
+    def test_json_matches_the_paginated_envelope(self):
+        for name in ('friends-list', 'pending-friend-requests'):
+            with self.subTest(name):
+                page, rows = self.walk(reverse(name))
+                response, content = self.stream(reverse(name), 'json')
+                self.assertEqual(response['Content-Type'], 'application/json')
+                streamed = json.loads(content)
+                self.assertEqual(streamed.pop('results'), {'data': rows})
+                page.pop('results')
+                self.assertEqual(streamed, page)
+
+    def test_streamed_queries_are_measured(self):
+        with CaptureQueriesContext(connection) as queries:
+            _, content = self.stream(reverse('friends-list'), 'ndjson')
+        self.assertEqual(len(content.splitlines()), 7)
+        # The friendships and user payloads are read while the body is written, after the view returned.
+        histogram = registry._histograms['users_request_db_queries']['FriendsListView']
+        self.assertEqual(histogram.sum, len(queries))
+        self.assertEqual(sum(histogram.counts), 1)
+
+
+class UserCountersTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(email='sender@example.com', password='password')
+        self.receiver = User.objects.create_user(email='receiver@example.com', password='password')
+
+    def assert_counters(self, user, friend_count, pending_request_count):
+        user.refresh_from_db()
+        self.assertEqual((user.friend_count, user.pending_request_count), (friend_count, pending_request_count))
+
+    def test_counters_follow_the_request(self):
+        friend_request, _ = send_friend_request(self.sender, self.receiver)
+        self.assert_counters(self.receiver, 0, 1)
+
+        respond_to_friend_request(friend_request, 'accept')
+        respond_to_friend_request(friend_request, 'accept')
+        self.assert_counters(self.sender, 1, 0)
+        self.assert_counters(self.receiver, 1, 0)
+
+        respond_to_friend_request(friend_request, 'reject')
+        self.assert_counters(self.sender, 0, 0)
+        self.assert_counters(self.receiver, 0, 0)
+
+    def test_reverse_request_accepts_the_pending_one(self):
+        send_friend_request(self.sender, self.receiver)
+        send_friend_request(self.receiver, self.sender)
+        self.assert_counters(self.sender, 1, 0)
+        self.assert_counters(self.receiver, 1, 0)
+
+    def test_deleting_a_user_releases_the_counters(self):
+        send_friend_request(self.sender, self.receiver)
+        self.sender.delete()
+        self.assert_counters(self.receiver, 0, 0)
+
+    def test_reconcile_repairs_drift(self):
+        send_friend_request(self.sender, self.receiver)
+        User.objects.filter(pk=self.receiver.pk).update(friend_count=5, pending_request_count=0)
+
+        drifted = reconcile_user_counters([self.sender.pk, self.receiver.pk])
+        self.assertEqual(drifted, [(self.receiver.pk, (5, 0), (0, 1))])
+        self.assert_counters(self.receiver, 0, 1)
+        self.assertEqual(reconcile_user_counters([self.sender.pk, self.receiver.pk]), [])
+
+
+class ImportUsersTests(TestCase):
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        return path
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.users = self.write('users.csv', 'email,name,password\nA@Example.com,Ann,secret-pass\nb@example.com,Bo,\n'
+                                             'c@example.com,Cy,\nnot-an-email,X,\n')
+        self.friendships = self.write('friendships.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'email': 'a@example.com', 'friend_email': 'b@example.com'},
+            {'email': 'b@example.com', 'friend_email': 'a@example.com'},
+            {'email': 'a@example.com', 'friend_email': 'c@example.com'},
+            {'email': 'a@example.com', 'friend_email': 'nobody@example.com'},
+        ]))
+
+    def test_import_creates_users_and_friendships(self):
+        call_command('import_users', self.users, friendships=self.friendships, stdout=StringIO())
+
+        ann = User.objects.get(email='a@example.com')
+        self.assertTrue(ann.check_password('secret-pass'))
+        self.assertFalse(User.objects.get(email='b@example.com').has_usable_password())
+        self.assertEqual(User.objects.count(), 3)
+        self.assertEqual(FriendRequest.objects.filter(status='accepted').count(), 2)
+        self.assertEqual(Friendship.objects.count(), 4)
+        self.assertEqual(ann.friend_count, 2)
+        self.assertFalse(os.path.exists(f'{self.users}.checkpoint'))
+
+        call_command('import_users', self.users, friendships=self.friendships, stdout=StringIO())
+        self.assertEqual((User.objects.count(), Friendship.objects.count()), (3, 4))
+
+    def test_import_skips_friends_whose_request_is_archived(self):
+        call_command('import_users', self.users, friendships=self.friendships, stdout=StringIO())
+        call_command('archive_friend_requests', accepted_after=0, stdout=StringIO())
+        self.assertFalse(FriendRequest.objects.exists())
+
+        call_command('import_users', friendships=self.friendships, stdout=StringIO())
+        self.assertFalse(FriendRequest.objects.exists())
+        self.assertEqual(ArchivedFriendRequest.objects.count(), 2)
+        self.assertEqual(User.objects.get(email='a@example.com').friend_count, 2)
+
+    def test_import_marks_suggestions_of_new_friends_for_recomputing(self):
+        call_command('import_users', self.users, stdout=StringIO())
+        call_command('compute_friend_suggestions', stdout=StringIO())
+        call_command('import_users', friendships=self.friendships, stdout=StringIO())
+        self.assertEqual(
+            sorted(User.objects.filter(suggestions_computed_at__isnull=True).values_list('email', flat=True)),
+            ['a@example.com', 'b@example.com', 'c@example.com']
+        )
+
+    def test_import_resumes_after_the_checkpoint(self):
+        checkpoint = {'friendships': {'path': os.path.abspath(self.friendships), 'rows': 2}}
+        self.write('friendships.jsonl.checkpoint', json.dumps(checkpoint))
+        call_command('import_users', self.users, stdout=StringIO())
+
+        call_command('import_users', friendships=self.friendships, batch_size=1, stdout=StringIO())
+        self.assertEqual(list(FriendRequest.objects.values_list('receiver__email', flat=True)), ['c@example.com'])
+
+
+class StatelessAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.local.clear()
+        user_cache.shared.clear()
+        self.user = User.objects.create_user(email='user@example.com', name='User', password='password')
+        self.access = get_tokens_for_user(self.user)['access']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def authenticate(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        return StatelessJWTAuthentication().authenticate(request)
+
+    def user_selects(self, queries):
+        return [query['sql'] for query in queries.captured_queries if 'FROM "users_user"' in query['sql']]
+
+    def test_requests_do_not_load_the_user(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+        self.assertEqual((user.pk, user.email, user.name), (self.user.pk, 'user@example.com', 'User'))
+
+        self.client.get(reverse('friends-list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('friends-list')).status_code, 200)
+        self.assertEqual(self.user_selects(queries), [])
+
+    def test_deactivated_user_is_locked_out(self):
+        self.assertEqual(self.client.get(reverse('friends-list')).status_code, 200)
+        # Through the model, the cached status is dropped on commit.
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get(reverse('friends-list')).status_code, 401)
+
+    def test_deactivated_behind_the_orms_back_is_locked_out_within_the_timeout(self):
+        self.assertEqual(self.client.get(reverse('friends-list')).status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(reverse('friends-list')).status_code, 200)
+
+        later = settings.JWT_USER_ACTIVE_CACHE_TIMEOUT + 1
+        with mock.patch('time.time', return_value=time.time() + later), \
+                mock.patch('time.monotonic', return_value=time.monotonic() + later):
+            self.assertEqual(self.client.get(reverse('friends-list')).status_code, 401)
+
+    @override_settings(STATELESS_JWT_AUTHENTICATION=False)
+    def test_setting_switches_back_to_loading_the_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            user, _ = self.authenticate()
+        self.assertEqual(len(self.user_selects(queries)), 1)
+        # Only a loaded row carries the password hash.
+        self.assertTrue(user.check_password('password'))
+
+
+class PasswordHashingTests(TestCase):
+    def create_user(self, email, encoded):
+        user = User.objects.create_user(email=email, password='password')
+        User.objects.filter(pk=user.pk).update(password=encoded)
+        return user
+
+    def login(self, name, email):
+        response = APIClient().post(reverse(name), {'email': email, 'password': 'password'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return User.objects.get(email=email).password
+
+    def current_parameters(self, encoded):
+        decoded = TunableArgon2PasswordHasher().decode(encoded)
+        return decoded['time_cost'], decoded['memory_cost'], decoded['parallelism']
+
+    def test_hashes_use_the_configured_parameters(self):
+        with override_settings(PASSWORD_ARGON2_TIME_COST=1, PASSWORD_ARGON2_MEMORY_COST=8192,
+                               PASSWORD_ARGON2_PARALLELISM=2):
+            self.assertEqual(self.current_parameters(make_password('password')), (1, 8192, 2))
+        with override_settings(PASSWORD_HASHERS=['users.hashers.TunableScryptPasswordHasher'],
+                               PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10):
+            self.assertEqual(TunableScryptPasswordHasher().decode(make_password('password'))['work_factor'], 2 ** 10)
+
+    def test_login_upgrades_outdated_hashes(self):
+        current = (settings.PASSWORD_ARGON2_TIME_COST, settings.PASSWORD_ARGON2_MEMORY_COST,
+                   settings.PASSWORD_ARGON2_PARALLELISM)
+        with override_settings(PASSWORD_ARGON2_TIME_COST=1, PASSWORD_ARGON2_MEMORY_COST=8192):
+            weaker = make_password('password')
+        legacy = PBKDF2PasswordHasher().encode('password', PBKDF2PasswordHasher().salt(), iterations=1000)
+        for name in ('login', 'async-login'):
+            for label, encoded in (('weaker argon2', weaker), ('pbkdf2', legacy)):
+                with self.subTest(name=name, hash=label):
+                    email = f'{name}-{label.replace(" ", "-")}@example.com'
+                    self.create_user(email, encoded)
+                    upgraded = self.login(name, email)
+                    self.assertNotEqual(upgraded, encoded)
+                    self.assertEqual(self.current_parameters(upgraded), current)
+                    # Already current: the next login leaves the hash alone.
+                    self.assertEqual(self.login(name, email), upgraded)
+
+    def test_hashing_executor_is_shared(self):
+        executors = []
+        threads = [threading.Thread(target=lambda: executors.append(get_hashing_executor())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({id(executor) for executor in executors}, {id(get_hashing_executor())})
+
+        async def hashing_thread():
+            return await run_in_hashing_pool(lambda: threading.current_thread().name)
+
+        self.assertTrue(async_to_sync(hashing_thread)().startswith('password-hashing'))
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        self.addCleanup(user_cache.shared.clear)
+        self.user = User.objects.create_user(email='user@example.com', password='password')
+        self.client = APIClient()
+
+    def post(self, name, refresh):
+        return self.client.post(reverse(name), {'refresh': refresh}, format='json')
+
+    def test_refresh_rotates_and_rejects_reuse(self):
+        for name in ('token-refresh', 'async-token-refresh'):
+            with self.subTest(name):
+                refresh = get_tokens_for_user(self.user)['refresh']
+                response = self.post(name, refresh)
+                self.assertEqual(response.status_code, 200)
+                rotated = response.json()['results']['data']['tokens']['refresh']
+
+                self.assertEqual(self.post(name, refresh).status_code, 401)
+                # The table alone still rejects it once the cached set is gone.
+                user_cache.shared.clear()
+                self.assertEqual(self.post(name, refresh).status_code, 401)
+                self.assertEqual(self.post(name, rotated).status_code, 200)
+
+    def test_logout_revokes_the_refresh_token(self):
+        refresh = get_tokens_for_user(self.user)['refresh']
+        self.assertEqual(self.post('logout', refresh).status_code, 200)
+        self.assertEqual(self.post('async-logout', refresh).status_code, 200)
+        self.assertEqual(self.post('token-refresh', refresh).status_code, 401)
+        self.assertEqual(self.post('logout', 'not-a-token').status_code, 401)
+
+    def test_only_one_request_reloads_the_revoked_set(self):
+        RevokedToken.objects.create(jti='revoked', expires_at=timezone.now() + timedelta(hours=1))
+        user_cache.shared.clear()
+        # Another request is reloading: this one checks the table for its own token and leaves the set alone.
+        user_cache.shared.add(REVOKED_TOKENS_RELOAD_LOCK_KEY, True)
+        with mock.patch('users.tokens.load_revoked_tokens') as load, self.assertNumQueries(2):
+            self.assertTrue(is_revoked('revoked'))
+            self.assertFalse(is_revoked('other'))
+        load.assert_not_called()
+
+        user_cache.shared.delete(REVOKED_TOKENS_RELOAD_LOCK_KEY)
+        self.assertTrue(is_revoked('revoked'))
+        self.assertIsNone(user_cache.shared.get(REVOKED_TOKENS_RELOAD_LOCK_KEY))
+        with self.assertNumQueries(0):
+            self.assertFalse(is_revoked('other'))
+
+    def test_prune_keeps_unexpired_tokens(self):
+        now = timezone.now()
+        RevokedToken.objects.bulk_create([
+            RevokedToken(jti='expired', expires_at=now - timedelta(minutes=1)),
+            RevokedToken(jti='live', expires_at=now + timedelta(hours=1)),
+        ])
+        call_command('prune_revoked_tokens', batch_size=1, stdout=StringIO())
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['live'])
+
+
+class ArchiveFriendRequestsTests(TestCase):
+    def setUp(self):
+        self.user, self.rejecter, self.friend, self.pending = [
+            User.objects.create_user(email=f'{name}@example.com', password='password')
+            for name in ('user', 'rejecter', 'friend', 'pending')
+        ]
+        respond_to_friend_request(send_friend_request(self.user, self.rejecter)[0], 'reject')
+        respond_to_friend_request(send_friend_request(self.user, self.friend)[0], 'accept')
+        send_friend_request(self.user, self.pending)
+        FriendRequest.objects.update(created_at=timezone.now() - timedelta(days=60))
+
+    def test_archives_answered_requests(self):
+        call_command('archive_friend_requests', rejected_after=30, accepted_after=30, batch_size=1, stdout=StringIO())
+
+        self.assertEqual(list(FriendRequest.objects.values_list('receiver__email', flat=True)), ['pending@example.com'])
+        self.assertEqual(
+            sorted(ArchivedFriendRequest.objects.values_list('receiver__email', 'status')),
+            [('friend@example.com', 'accepted'), ('rejecter@example.com', 'rejected')]
+        )
+        self.assertEqual(Friendship.objects.count(), 2)
+        self.assertEqual(reconcile_user_counters([self.user.pk, self.friend.pk, self.pending.pk]), [])
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {get_tokens_for_user(self.user)['access']}")
+        response = client.post(reverse('send-friend-request'), {'receiver': self.friend.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post(reverse('bulk-send-friend-request'), {'receivers': [self.friend.pk]}, format='json')
+        self.assertEqual(response.json()['results']['data'][0]['error'], "You are already friends.")
+        # An archived rejection no longer blocks the pair.
+        self.assertEqual(send_friend_request(self.rejecter, self.user)[1], 'sent')
+
+    def test_keeps_recent_requests_and_purges_the_archive(self):
+        call_command('archive_friend_requests', rejected_after=90, accepted_after=90, stdout=StringIO())
+        self.assertEqual(FriendRequest.objects.count(), 3)
+
+        call_command('archive_friend_requests', rejected_after=30, accepted_after=90, purge_after=30, stdout=StringIO())
+        self.assertEqual(
+            list(FriendRequest.objects.values_list('status', flat=True).order_by('id')), ['accepted', 'sent']
+        )
+        self.assertFalse(ArchivedFriendRequest.objects.exists())
+
+
+@override_settings(USER_EVENTS_BROKER='users.events.InMemoryBroker', USER_EVENTS_KEEPALIVE_SECONDS=60)
+class FriendRequestEventsTests(TestCase):
+    def setUp(self):
+        get_broker.cache_clear()
+        self.addCleanup(get_broker.cache_clear)
+        self.sender = User.objects.create_user(email='sender@example.com', password='password')
+        self.receiver = User.objects.create_user(email='receiver@example.com', password='password')
+
+    def capture(self, action, *args):
+        with self.captureOnCommitCallbacks() as callbacks:
+            result = action(*args)
+        return result, callbacks
+
+    async def commit(self, action, *args):
+        """Run ``action`` in the test transaction, check nothing was published yet, then run its commit hooks."""
+        result, callbacks = await sync_to_async(self.capture)(action, *args)
+        await asyncio.sleep(0)
+        for queue in self.queues:
+            self.assertTrue(queue.empty())
+        for callback in callbacks:
+            await sync_to_async(callback)()
+        return result
+
+    async def next_event(self, queue):
+        return await asyncio.wait_for(queue.get(), timeout=1)
+
+    async def collect(self, stream):
+        return [chunk async for chunk in stream]
+
+    async def test_receiver_and_sender_hear_about_requests_after_commit(self):
+        broker = get_broker()
+        async with broker.subscribe(self.receiver.pk) as received, broker.subscribe(self.sender.pk) as answered:
+            self.queues = [received, answered]
+
+            friend_request, _ = await self.commit(send_friend_request, self.sender, self.receiver)
+            event = await self.next_event(received)
+            self.assertEqual(event['type'], 'friend_request.received')
+            self.assertEqual(event['data']['id'], friend_request.pk)
+            self.assertEqual(event['data']['sender'], self.sender.email)
+
+            await self.commit(respond_to_friend_request, friend_request, 'reject')
+            self.assertEqual(await self.next_event(answered), {
+                'type': 'friend_request.rejected',
+                'data': {'id': friend_request.pk, 'receiver': self.receiver.pk, 'status': 'rejected'},
+            })
+
+            await self.commit(respond_to_friend_request, friend_request, 'accept')
+            self.assertEqual((await self.next_event(answered))['type'], 'friend_request.accepted')
+            self.assertTrue(received.empty())
+
+    async def test_stream_ends_when_the_token_expires(self):
+        stream = event_stream(self.receiver.pk, time.time() + 0.1)
+        chunks = await asyncio.wait_for(self.collect(stream), timeout=1)
+        self.assertEqual(chunks, [b'retry: %d\n\n' % (settings.USER_EVENTS_RETRY_SECONDS * 1000)])
+        self.assertNotIn(self.receiver.pk, get_broker()._subscribers)
+
+    async def test_view_streams_until_the_token_expires(self):
+        token = AccessToken.for_user(self.receiver)
+        token.set_exp(lifetime=timedelta(seconds=1))
+        response = await self.async_client.get(reverse('async-events'), {'token': str(token)})
+        self.assertEqual(response.status_code, 200)
+        chunks = await asyncio.wait_for(self.collect(response.streaming_content), timeout=3)
+        self.assertEqual(len(chunks), 1)
@@ -1,13 +1,116 @@
-from rest_framework.throttling import UserRateThrottle
+import time
 
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
 
-class FriendRequestThrottle(UserRateThrottle):
-    scope = 'friend_request'
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Sliding-window counter: the current and previous fixed windows are kept as
+    two integers per user, and the previous one is weighted by how much of it
+    still overlaps the sliding window.
+
+    Counting goes through the cache's atomic ``incr`` (a single command on
+    Redis), so the limit holds across workers sharing the cache.
+    """
+    scope = None
+    cache_alias = 'default'
+    durations = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            raise ImproperlyConfigured(f"No default throttle rate set for '{self.scope}' scope")
+        num, period = rate.split('/')
+        self.num_requests = int(num)
+        self.duration = self.durations[period[0]]
+        self.cache = caches[self.cache_alias]
+        self._wait = None
+        self._charged = None
+
+    def get_cache_key(self, request, view):
+        ident = request.user.pk if request.user and request.user.is_authenticated else self.get_ident(request)
+        return f'throttle:{self.scope}:{ident}'
+
+    def get_cost(self, request, view):
+        # Batch endpoints charge one unit per item they act on.
+        get_throttle_cost = getattr(view, 'get_throttle_cost', None)
+        return get_throttle_cost(request) if get_throttle_cost else 1
+
+    def _incr(self, key, delta):
+        self.cache.add(key, 0, timeout=self.duration * 2)
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            # The key expired between add() and incr().
+            self.cache.add(key, 0, timeout=self.duration * 2)
+            return self.cache.incr(key, delta)
 
     def allow_request(self, request, view):
-        # Call the parent method to check the rate limit
-        return super().allow_request(request, view)
+        key = self.get_cache_key(request, view)
+        cost = self.get_cost(request, view)
+        if key is None or cost <= 0:
+            return True
+
+        now = time.time()
+        window, offset = divmod(now, self.duration)
+        current_key = f'{key}:{int(window)}'
+        current = self._incr(current_key, cost)
+        previous = self.cache.get(f'{key}:{int(window) - 1}', 0)
+
+        elapsed = offset / self.duration
+        if previous * (1 - elapsed) + current <= self.num_requests:
+            self._charged = (current_key, cost)
+            return True
+
+        # Give the units back so a rejected request does not count against the user.
+        self.cache.decr(current_key, cost)
+        self._wait = self._wait_seconds(previous, current - cost, cost, elapsed)
+        return False
+
+    def _wait_seconds(self, previous, current, cost, elapsed):
+        if cost > self.num_requests:
+            return None
+        remaining = self.num_requests - current - cost
+        if remaining >= 0 and previous:
+            # Enough of the previous window slides out before this one ends.
+            return max(1 - elapsed - remaining / previous, 0) * self.duration
+        # Otherwise wait until this window becomes the previous one and decays enough.
+        return (1 - elapsed + 1 - (self.num_requests - cost) / current) * self.duration
 
     def wait(self):
-        # Return the wait time if the rate limit has been exceeded
-        return super().wait()
+        return self._wait
+
+    def refund(self):
+        """Give back what the last allowed request was charged, when something after this throttle rejects it."""
+        current_key, cost = self._charged
+        self.cache.decr(current_key, cost)
+
+
+class FriendRequestThrottle(SlidingWindowThrottle):
+    scope = 'friend_request'
+
+
+class BulkFriendRequestThrottle(SlidingWindowThrottle):
+    """
+    Receivers per period through the bulk endpoint: a rate of its own, since
+    charged per receiver against the single request rate no batch over three
+    would fit. Each call is still charged one single request, so batches of
+    one cannot be used to get around that rate.
+    """
+    scope = 'bulk_friend_request'
+
+    def __init__(self):
+        super().__init__()
+        self.single = FriendRequestThrottle()
+
+    def allow_request(self, request, view):
+        if not self.single.allow_request(request, None):
+            self._wait = self.single.wait()
+            return False
+        if super().allow_request(request, view):
+            return True
+        self.single.refund()
+        return False
@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .cache import REVOKED_TOKENS_LOADED_KEY, REVOKED_TOKENS_RELOAD_LOCK_KEY, revoked_token_key, user_cache
+from .models import RevokedToken
+from .routers import primary_reads
+from .utils import chunked
+
+# Revoked jtis are a set in the shared cache tier, one key per token that lasts as long as the token, so
+# checking a token costs one cache read and expired entries drop out on their own. The table behind it is
+# the durable copy the set is reloaded from, and its primary key is what stops a token being used twice.
+
+# Seconds the reload lock is held at most, so a reloader that dies does not leave the set unloaded for long.
+RELOAD_LOCK_TIMEOUT = 60
+
+
+def revocation_timeout():
+    return int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+
+
+def load_revoked_tokens():
+    """Put every unexpired revocation in the cached set and mark the set complete."""
+    shared = user_cache.shared
+    revoked = RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list('jti', flat=True)
+    # A replica lagging behind a revocation must not mark the set complete without it.
+    with primary_reads():
+        for chunk in chunked(revoked.iterator(chunk_size=5000), 5000):
+            shared.set_many({revoked_token_key(jti): True for jti in chunk}, revocation_timeout())
+    # Expiring the marker reloads the set now and then, repairing keys the cache evicted.
+    shared.set(REVOKED_TOKENS_LOADED_KEY, True, settings.JWT_REVOKED_TOKENS_RELOAD_INTERVAL)
+
+
+def is_revoked(jti):
+    key = revoked_token_key(jti)
+    found = user_cache.shared.get_many([key, REVOKED_TOKENS_LOADED_KEY])
+    if key in found or REVOKED_TOKENS_LOADED_KEY in found:
+        return key in found
+    # One request reloads the set; the ones arriving meanwhile look up their own token instead of reloading too.
+    if user_cache.shared.add(REVOKED_TOKENS_RELOAD_LOCK_KEY, True, RELOAD_LOCK_TIMEOUT):
+        try:
+            load_revoked_tokens()
+        finally:
+            user_cache.shared.delete(REVOKED_TOKENS_RELOAD_LOCK_KEY)
+        return user_cache.shared.get(key) is not None
+    with primary_reads():
+        return RevokedToken.objects.filter(jti=jti, expires_at__gt=timezone.now()).exists()
+
+
+def revoke(token):
+    """
+    Revoke ``token`` until it expires. Raises ``TokenError`` when it already
+    was, so of two requests presenting the same refresh token only one gets
+    to rotate it, whichever worker's cache they hit.
+    """
+    jti = token[api_settings.JTI_CLAIM]
+    expires_at = datetime_from_epoch(token['exp'])
+    # The cache first: if the insert fails below, the token is revoked anyway.
+    user_cache.shared.set(revoked_token_key(jti), True, max(int((expires_at - timezone.now()).total_seconds()), 1))
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+    except IntegrityError:
+        raise TokenError(_("Token is blacklisted"))
+
+
+class RevocableRefreshToken(RefreshToken):
+    """
+    Refresh token checked against the revocation store when it is used.
+    ``blacklist`` is what simplejwt's refresh serializer calls to revoke the
+    old token after rotating it.
+    """
+
+    def verify(self, *args, **kwargs):
+        super().verify(*args, **kwargs)
+        if is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        revoke(self)
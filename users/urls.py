@@ -1,13 +1,36 @@
 from django.urls import path
+
+from . import async_views
 from .views import SignupView, LoginView, UserSearchView, SendFriendRequestView, RespondFriendRequestView, \
-    FriendsListView, PendingFriendRequestsView
+    FriendsListView, PendingFriendRequestsView, CacheStatsView, BulkSendFriendRequestView, BulkRespondFriendRequestView, \
+    MetricsView, MutualFriendsView, FriendSuggestionsView, UserSummaryView, RefreshTokenView, LogoutView
 
 urlpatterns = [
     path('signup/', SignupView.as_view(), name='signup'),
     path('login/', LoginView.as_view(), name='login'),
+    path('token/refresh/', RefreshTokenView.as_view(), name='token-refresh'),
+    path('logout/', LogoutView.as_view(), name='logout'),
     path('search/', UserSearchView.as_view(), name='user-search'),
     path('friend-request/', SendFriendRequestView.as_view(), name='send-friend-request'),
     path('friend-request/<int:pk>/', RespondFriendRequestView.as_view(), name='respond-friend-request'),
+    path('friend-request/bulk/', BulkSendFriendRequestView.as_view(), name='bulk-send-friend-request'),
+    path('friend-request/bulk/respond/', BulkRespondFriendRequestView.as_view(), name='bulk-respond-friend-request'),
     path('friends/', FriendsListView.as_view(), name='friends-list'),
+    path('friends/mutual/<int:pk>/', MutualFriendsView.as_view(), name='mutual-friends'),
+    path('friends/suggestions/', FriendSuggestionsView.as_view(), name='friend-suggestions'),
     path('friend-requests/pending/', PendingFriendRequestsView.as_view(), name='pending-friend-requests'),
+    path('me/summary/', UserSummaryView.as_view(), name='user-summary'),
+    path('async/signup/', async_views.signup, name='async-signup'),
+    path('async/login/', async_views.login, name='async-login'),
+    path('async/token/refresh/', async_views.refresh_token, name='async-token-refresh'),
+    path('async/logout/', async_views.logout, name='async-logout'),
+    path('async/search/', async_views.search, name='async-user-search'),
+    path('async/friend-request/', async_views.send_request, name='async-send-friend-request'),
+    path('async/friend-request/<int:pk>/', async_views.respond_request, name='async-respond-friend-request'),
+    path('async/friends/', async_views.friends, name='async-friends-list'),
+    path('async/friend-requests/pending/', async_views.pending_friend_requests, name='async-pending-friend-requests'),
+    path('async/me/summary/', async_views.summary, name='async-user-summary'),
+    path('async/events/', async_views.events, name='async-events'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
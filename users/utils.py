@@ -1,18 +1,68 @@
+from itertools import islice
+
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from .renderers import dumps
 
-def custom_response(data=None, message="", status=200, errors=None):
-    return Response({
+
+def envelope(data=None, message="", status=200, errors=None):
+    return {
         "message": message,
         "results": {"data": data},
         "status": status,
         "errors": errors or {"message": {}}
-    }, status=status)
+    }
+
+
+def custom_response(data=None, message="", status=200, errors=None):
+    return Response(envelope(data, message, status, errors), status=status)
+
+
+def async_response(data=None, message="", status=200, errors=None):
+    """``custom_response`` for the plain Django async views, which bypass DRF rendering."""
+    return HttpResponse(dumps(envelope(data, message, status, errors)), status=status,
+                        content_type="application/json")
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def streaming_response(rows, message="", stream="json", chunk_size=500):
+    """
+    Write ``rows`` out incrementally, either as the ``custom_response``
+    envelope (``json``) or as one row per line (``ndjson``).
+    """
+    if stream == "ndjson":
+        def content():
+            for chunk in chunked(rows, chunk_size):
+                yield b"".join(dumps(row) + b"\n" for row in chunk)
+
+        return StreamingHttpResponse(content(), content_type="application/x-ndjson")
+
+    def content():
+        yield b'{"message":%s,"results":{"data":[' % dumps(message)
+        separator = b""
+        for chunk in chunked(rows, chunk_size):
+            yield separator + b",".join(dumps(row) for row in chunk)
+            separator = b","
+        yield b']},"status":200,"errors":{"message":{}}}'
+
+    return StreamingHttpResponse(content(), content_type="application/json")
 
 
 def get_tokens_for_user(user):
     refresh = RefreshToken.for_user(user)
+    # Claims for StatelessJWTAuthentication. Staff tokens carry none, so their
+    # permissions are always read from the database.
+    if not user.is_staff:
+        refresh['email'] = user.email
+        refresh['name'] = user.name
+        refresh['is_active'] = user.is_active
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
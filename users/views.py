@@ -1,14 +1,28 @@
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
 
 from rest_framework import generics, status
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework_simplejwt.exceptions import TokenError
 
 from .serializers import SignupSerializer, LoginSerializer, UserSerializer, FriendRequestSerializer, \
-    PendingFriendRequestSerializer
-from .throttles import FriendRequestThrottle
-from .utils import custom_response, get_tokens_for_user
-from .models import FriendRequest
+    PendingFriendRequestSerializer, BulkFriendRequestSerializer, BulkRespondFriendRequestSerializer, \
+    UserSummarySerializer, RefreshTokenSerializer, LogoutSerializer
+from .throttles import BulkFriendRequestThrottle, FriendRequestThrottle
+from .cache import get_pending_count, get_user_payloads, user_cache
+from .utils import chunked, custom_response, get_tokens_for_user, streaming_response
+from .metrics import registry
+from .models import FriendRequest, FriendSuggestion, Friendship
+from .conditional import ConditionalListMixin
+from .graph import mutual_friend_ids, suggest_friends
+from .routers import current_reads, replica_reads
+from .services import respond_to_friend_request, send_friend_request
+from .pagination import UserSearchCursorPagination, UserSearchPagination, FriendsCursorPagination, \
+    MutualFriendsPagination, PendingFriendRequestCursorPagination
+from .search import search_users
 
 User = get_user_model()
 
@@ -64,30 +78,110 @@ class LoginView(generics.GenericAPIView):
         )
 
 
-class UserSearchPagination(PageNumberPagination):
-    page_size = 10
+class RefreshTokenView(generics.GenericAPIView):
+    serializer_class = RefreshTokenSerializer
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            valid = serializer.is_valid()
+        except TokenError as error:
+            return custom_response(
+                data=None,
+                message="Token refresh failed.",
+                status=status.HTTP_401_UNAUTHORIZED,
+                errors={"message": str(error)}
+            )
+        if valid:
+            return custom_response(
+                data={"tokens": serializer.validated_data},
+                message="Token refreshed successfully.",
+                status=status.HTTP_200_OK
+            )
+        return custom_response(
+            data=None,
+            message="Token refresh failed.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": serializer.errors}
+        )
+
+
+class LogoutView(generics.GenericAPIView):
+    serializer_class = LogoutSerializer
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return custom_response(
+                data=None,
+                message="Logout failed.",
+                status=status.HTTP_400_BAD_REQUEST,
+                errors={"message": serializer.errors}
+            )
+        try:
+            serializer.save()
+        except TokenError as error:
+            return custom_response(
+                data=None,
+                message="Logout failed.",
+                status=status.HTTP_401_UNAUTHORIZED,
+                errors={"message": str(error)}
+            )
+        # Access tokens already issued stay valid until they expire.
+        return custom_response(
+            data=None,
+            message="User logged out successfully.",
+            status=status.HTTP_200_OK
+        )
+
+
+class ReplicaReadMixin:
+    """Serve the view's reads from a replica once the request is authenticated."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._replica_reads = replica_reads(request.user.pk)
+        self._replica_reads.__enter__()
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        if replica_context := getattr(self, '_replica_reads', None):
+            replica_context.__exit__(None, None, None)
+            self._replica_reads = None
+        return super().finalize_response(request, response, *args, **kwargs)
 
-class UserSearchView(generics.ListAPIView):
+
+class UserSearchView(ReplicaReadMixin, generics.ListAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = UserSearchPagination
+    cursor_pagination_class = UserSearchCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
         query = self.request.query_params.get('q', None)
         if query is None:
             return User.objects.none()
 
-        # First search email match
-        if User.objects.filter(email__iexact=query).exists():
-            return User.objects.filter(email__iexact=query)
-
-        # After search by name
-        return User.objects.filter(name__icontains=query)
+        # The rank stays in the rows for the cursor paginator, from_values() drops it.
+        return UserSerializer.values(search_users(query), 'search_rank')
 
     def list(self, request, *args, **kwargs):
-        response = super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        response = self.get_paginated_response(UserSerializer.from_values(page))
         return custom_response(
             data=response.data,
             message="User search results.",
@@ -102,17 +196,26 @@ class SendFriendRequestView(generics.CreateAPIView):
     throttle_classes = [FriendRequestThrottle]
 
     def create(self, request, *args, **kwargs):
-        data = {
-            'sender': request.user.id,
-            'receiver': request.data.get('receiver')
-        }
-        serializer = self.get_serializer(data=data)
+        serializer = self.get_serializer(data={'receiver': request.data.get('receiver')})
         if serializer.is_valid():
-            serializer.save()
+            friend_request, outcome = send_friend_request(request.user, serializer.validated_data['receiver'])
+            if outcome == 'sent':
+                return custom_response(
+                    data=self.get_serializer(friend_request).data,
+                    message="Friend request sent successfully.",
+                    status=status.HTTP_201_CREATED
+                )
+            if outcome == 'accepted':
+                return custom_response(
+                    data=self.get_serializer(friend_request).data,
+                    message="Friend request accepted successfully.",
+                    status=status.HTTP_200_OK
+                )
             return custom_response(
-                data=serializer.data,
-                message="Friend request sent successfully.",
-                status=status.HTTP_201_CREATED
+                data=None,
+                message="Friend request failed.",
+                status=status.HTTP_400_BAD_REQUEST,
+                errors={"message": {"non_field_errors": ["A friend request has already been sent."]}}
             )
         return custom_response(
             data=None,
@@ -129,7 +232,7 @@ class RespondFriendRequestView(generics.UpdateAPIView):
 
     def update(self, request, *args, **kwargs):
         friend_request = self.get_object()
-        if friend_request.receiver != request.user:
+        if friend_request.receiver_id != request.user.id:
             return custom_response(
                 data=None,
                 message="Unauthorized action.",
@@ -138,18 +241,14 @@ class RespondFriendRequestView(generics.UpdateAPIView):
             )
 
         action = request.data.get('action')
-        if action == 'accept':
-            friend_request.status = 'accepted'
-        elif action == 'reject':
-            friend_request.status = 'rejected'
-        else:
+        if action not in ('accept', 'reject'):
             return custom_response(
                 data=None,
                 message="Invalid action.",
                 status=status.HTTP_400_BAD_REQUEST,
                 errors={"message": "Action must be 'accept' or 'reject'."}
             )
-        friend_request.save()
+        respond_to_friend_request(friend_request, action)
 
         return custom_response(
             data={"status": friend_request.status},
@@ -158,49 +257,207 @@ class RespondFriendRequestView(generics.UpdateAPIView):
         )
 
 
-class FriendsListView(generics.ListAPIView):
+class BulkSendFriendRequestView(generics.GenericAPIView):
+    serializer_class = BulkFriendRequestSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [BulkFriendRequestThrottle]
+
+    def get_throttle_cost(self, request):
+        # Every receiver counts against the bulk rate.
+        receivers = request.data.get('receivers')
+        return len(receivers) if isinstance(receivers, list) else 1
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            results = serializer.save()
+            return custom_response(
+                data=results,
+                message="Friend requests processed.",
+                status=status.HTTP_200_OK
+            )
+        return custom_response(
+            data=None,
+            message="Friend request failed.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": serializer.errors}
+        )
+
+
+class BulkRespondFriendRequestView(generics.GenericAPIView):
+    serializer_class = BulkRespondFriendRequestSerializer
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if serializer.is_valid():
+            results = serializer.save()
+            return custom_response(
+                data=results,
+                message="Friend requests processed.",
+                status=status.HTTP_200_OK
+            )
+        return custom_response(
+            data=None,
+            message="Invalid action.",
+            status=status.HTTP_400_BAD_REQUEST,
+            errors={"message": serializer.errors}
+        )
+
+
+class StreamingListMixin:
+    """
+    Cursor-paginated list wrapped in ``custom_response``; ``?stream=json`` or
+    ``?stream=ndjson`` instead writes every row out while iterating the
+    queryset, so memory stays flat regardless of the list size.
+    """
+    list_message = ""
+    stream_chunk_size = 2000
+
+    def list(self, request, *args, **kwargs):
+        stream = request.query_params.get('stream')
+        if stream in ('json', 'ndjson'):
+            return self.stream(stream)
+
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        response = self.get_paginated_response(self.serialize_rows(page))
+        return custom_response(
+            data=response.data,
+            message=self.list_message,
+            status=response.status_code
+        )
+
+    def serialize_rows(self, rows):
+        return self.get_serializer(rows, many=True).data
+
+    def stream(self, stream):
+        queryset = self.filter_queryset(self.get_queryset()).order_by(self.paginator.ordering)
+        # The body is written after finalize_response, so each chunk re-enters the view's read routing.
+        reads = current_reads()
+
+        def rows():
+            chunks = chunked(queryset.iterator(chunk_size=self.stream_chunk_size), self.stream_chunk_size)
+            while True:
+                with reads():
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        return
+                    serialized = self.serialize_rows(chunk)
+                yield from serialized
+
+        return streaming_response(rows(), message=self.list_message, stream=stream)
+
+
+class FriendsListView(ReplicaReadMixin, ConditionalListMixin, StreamingListMixin, generics.ListAPIView):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FriendsCursorPagination
+    list_message = "List of friends retrieved successfully."
 
     def get_queryset(self):
-        user = self.request.user
+        # Pages are read from the (user, friend) index alone, the user rows come from the cache.
+        return Friendship.objects.filter(user=self.request.user).values('friend_id')
 
-        # Find users who sent a friend request to the current user and it was accepted
-        received_friend_request = FriendRequest.objects.filter(receiver=user, status='accepted').values_list('sender',
-                                                                                                             flat=True)
+    def serialize_rows(self, rows):
+        friend_ids = [row['friend_id'] for row in rows]
+        payloads = get_user_payloads(friend_ids)
+        return [payloads[friend_id] for friend_id in friend_ids if friend_id in payloads]
 
-        # Find users who received a friend request from the current user and it was accepted
-        sent_friend_request = FriendRequest.objects.filter(sender=user, status='accepted').values_list('receiver',
-                                                                                                       flat=True)
 
-        # Combine both sets of friends
-        friends_ids = list(received_friend_request) + list(sent_friend_request)
+class MutualFriendsView(generics.ListAPIView):
+    serializer_class = UserSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = MutualFriendsPagination
 
-        return User.objects.filter(id__in=friends_ids)
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(mutual_friend_ids(request.user.id, kwargs['pk']))
+        payloads = get_user_payloads(page)
+        response = self.get_paginated_response([payloads[user_id] for user_id in page if user_id in payloads])
+        return custom_response(
+            data=response.data,
+            message="List of mutual friends retrieved successfully.",
+            status=response.status_code
+        )
+
+
+class FriendSuggestionsView(ReplicaReadMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+        suggestions = list(FriendSuggestion.objects.filter(user=request.user).order_by(
+            '-mutual_friends', 'suggested_id'
+        ).values_list('suggested_id', 'mutual_friends'))
+        if not suggestions and not User.objects.filter(
+            pk=request.user.id, suggestions_computed_at__isnull=False
+        ).exists():
+            # Not precomputed yet, typically a new user with few friends: cheap to work out now, up to a cap.
+            suggestions = suggest_friends(request.user.id, max_friends=settings.FRIEND_SUGGESTION_LIVE_MAX_FRIENDS)
+
+        payloads = get_user_payloads([suggested_id for suggested_id, _ in suggestions])
         return custom_response(
-            data=serializer.data,
-            message="List of friends retrieved successfully.",
+            data=[
+                {**payloads[suggested_id], "mutual_friends": mutual_friends}
+                for suggested_id, mutual_friends in suggestions if suggested_id in payloads
+            ],
+            message="Friend suggestions retrieved successfully.",
             status=status.HTTP_200_OK
         )
 
 
-class PendingFriendRequestsView(generics.ListAPIView):
+class PendingFriendRequestsView(ReplicaReadMixin, ConditionalListMixin, StreamingListMixin, generics.ListAPIView):
     serializer_class = PendingFriendRequestSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PendingFriendRequestCursorPagination
+    list_message = "List of pending friend requests retrieved successfully."
 
     def get_queryset(self):
         user = self.request.user
-        return FriendRequest.objects.filter(receiver=user, status='sent')
+        # Most polls find nothing pending, answer those from the cached count.
+        if get_pending_count(user.id) == 0:
+            return FriendRequest.objects.none()
+        return self.get_serializer_class().eager_load(FriendRequest.objects.filter(receiver=user, status='sent'))
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
+
+class UserSummaryView(ReplicaReadMixin, generics.GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        # Badge counts from the counters on the user row, without counting any lists.
         return custom_response(
-            data=serializer.data,
-            message="List of pending friend requests retrieved successfully.",
+            data=UserSummarySerializer.values(User.objects.filter(pk=request.user.pk)).first(),
+            message="Summary retrieved successfully.",
             status=status.HTTP_200_OK
         )
+
+
+class CacheStatsView(generics.GenericAPIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return custom_response(
+            data=user_cache.stats(),
+            message="Cache statistics retrieved successfully.",
+            status=status.HTTP_200_OK
+        )
+
+
+class MetricsView(generics.GenericAPIView):
+    """Prometheus metrics, for the bearer of ``METRICS_TOKEN`` or, when none is set, for staff users."""
+    permission_classes = [IsAdminUser]
+
+    def get_authenticators(self):
+        # The metrics token is not a JWT; with one set, it is checked in get() instead.
+        return [] if settings.METRICS_TOKEN else super().get_authenticators()
+
+    def get_permissions(self):
+        return [AllowAny()] if settings.METRICS_TOKEN else super().get_permissions()
+
+    def get(self, request, *args, **kwargs):
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if settings.METRICS_TOKEN and not constant_time_compare(token, settings.METRICS_TOKEN):
+            return custom_response(
+                data=None,
+                message="Invalid metrics token.",
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return HttpResponse(registry.render(user_cache.stats()), content_type='text/plain; version=0.0.4')